@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Параметры ограничений (можно переопределить переменными окружения)
+USER_RATE = float(os.getenv('QR_USER_RATE', '0.1'))  # документов в секунду на пользователя
+USER_BURST = float(os.getenv('QR_USER_BURST', '3'))  # сколько документов можно отправить подряд
+MAX_PAGES_IN_FLIGHT = int(os.getenv('QR_MAX_PAGES_IN_FLIGHT', '100'))
+# Средний размер страницы чертежа в PDF, используется для оценки до загрузки файла
+PDF_BYTES_PER_PAGE = int(os.getenv('QR_PDF_BYTES_PER_PAGE', str(200 * 1024)))
+
+
+def estimate_pages(file_name, file_size):
+    """Оценивает количество страниц документа по размеру файла, не загружая его"""
+    if not file_name.lower().endswith('.pdf'):
+        return 1
+    return max(1, (file_size or 0) // PDF_BYTES_PER_PAGE)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, tokens=1):
+        """Забирает токены, если их достаточно"""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """
+    Допуск задач к обработке
+
+    Задача запускается сразу, только если у пользователя есть токен и суммарное
+    число страниц в работе не превышает max_pages_in_flight. Остальные задачи
+    ждут в очереди и допускаются по мере освобождения ресурсов, не занимая
+    обработчики.
+    """
+
+    def __init__(self, user_rate=USER_RATE, user_burst=USER_BURST,
+                 max_pages_in_flight=MAX_PAGES_IN_FLIGHT):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_pages_in_flight = max_pages_in_flight
+        self._buckets = {}
+        self._admitted = {}  # job_id -> число страниц
+        self._waiting = OrderedDict()  # job_id -> (user_id, число страниц)
+
+    @property
+    def pages_in_flight(self):
+        return sum(self._admitted.values())
+
+    @property
+    def admitted_jobs(self):
+        return list(self._admitted)
+
+    def _bucket(self, user_id):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._buckets[user_id] = bucket
+        return bucket
+
+    def _has_capacity(self, pages):
+        # Документ больше лимита допускается, когда ничего другого не обрабатывается
+        in_flight = self.pages_in_flight
+        return in_flight == 0 or in_flight + pages <= self.max_pages_in_flight
+
+    def try_admit(self, job_id, user_id, pages):
+        """Допускает задачу к обработке, если позволяют лимиты"""
+        if not self._has_capacity(pages) or not self._bucket(user_id).try_take():
+            return False
+        self._admitted[job_id] = pages
+        return True
+
+    def defer(self, job_id, user_id, pages):
+        """Ставит задачу в очередь ожидания и возвращает ее позицию (с 1)"""
+        self._waiting[job_id] = (user_id, pages)
+        logger.info(f"Задача {job_id} ожидает допуска ({pages} стр.), "
+                    f"в очереди: {len(self._waiting)}, страниц в работе: {self.pages_in_flight}")
+        return len(self._waiting)
+
+    def admit_waiting(self):
+        """Допускает ожидающие задачи в порядке очереди и возвращает их ID"""
+        admitted = []
+        for job_id, (user_id, pages) in list(self._waiting.items()):
+            if self.try_admit(job_id, user_id, pages):
+                del self._waiting[job_id]
+                admitted.append(job_id)
+        # Пустые ведра заново создаются полными, хранить их не нужно
+        for user_id in [u for u, bucket in self._buckets.items() if bucket.full]:
+            del self._buckets[user_id]
+        return admitted
+
+    def mark_admitted(self, job_id, pages):
+        """Учитывает задачу, допущенную до перезапуска бота"""
+        self._admitted[job_id] = pages
+
+    def release(self, job_id):
+        """Освобождает ресурсы завершенной задачи"""
+        self._admitted.pop(job_id, None)
+        self._waiting.pop(job_id, None)
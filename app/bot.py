@@ -6,15 +6,24 @@ current_dir = str(Path(__file__).resolve().parent.parent)
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-from telegram import Update
+from telegram import Update, InputMediaDocument
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 import logging
-from app.models import Document, QRCode, DocumentHistory, init_db
+from app.models import (
+    Document, QRCode, DocumentHistory, ProcessingJob, init_db,
+    JOB_KIND_DOCUMENT, JOB_KIND_ALBUM, JOB_DEFERRED, JOB_QUEUED, JOB_RASTERIZING, JOB_PLACING, JOB_ASSEMBLING, JOB_READY,
+    JOB_DELIVERING, JOB_SENT, JOB_FAILED,
+)
 from sqlalchemy.orm import sessionmaker
+import io
 import os
+import shutil
+import socket
+import asyncio
 from datetime import datetime
 from app.config import BOT_TOKEN, SAVE_DIRECTORY
-from app import qr_processor
+from app import workers, jobs, admission, model_registry, pdf_inspect
 import traceback
 
 # Enable logging
@@ -35,15 +44,54 @@ Session = sessionmaker(bind=engine)
 # Create save directory if it doesn't exist
 SAVE_DIR = os.path.join(os.path.dirname(__file__), SAVE_DIRECTORY)
 os.makedirs(SAVE_DIR, exist_ok=True)
+JOBS_DIR = os.path.join(SAVE_DIR, 'jobs')
+os.makedirs(JOBS_DIR, exist_ok=True)
+
+# Режим развертывания: 'local' - документы обрабатываются пулом внутри бота,
+# 'split' - бот только ставит задачи в очередь, их разбирают процессы
+# `python -m app.workers`, а бот доставляет готовые результаты
+DEPLOY_MODE = os.getenv('QR_DEPLOY_MODE', 'local')
+DELIVERY_INTERVAL = float(os.getenv('QR_DELIVERY_INTERVAL', '1.0'))
+# Имя экземпляра бота. Задачи отмечаются им, и после перезапуска экземпляр
+# восстанавливает только свои задачи: их файлы, ожидающие альбомы и учет
+# нагрузки есть только в его процессе. У каждого экземпляра с общей БД имя
+# должно быть своим и не меняться между перезапусками
+REPLICA_ID = os.getenv('QR_REPLICA_ID', socket.gethostname())
+
+# Режим получения обновлений: 'polling' или 'webhook'. В режиме webhook
+# обновления принимает встроенный асинхронный HTTP-сервер, поэтому несколько
+# экземпляров бота можно поставить за балансировщик нагрузки (у каждого
+# должен быть свой QR_REPLICA_ID)
+BOT_MODE = os.getenv('QR_BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('QR_WEBHOOK_URL')  # публичный адрес, например https://example.com/telegram
+WEBHOOK_LISTEN = os.getenv('QR_WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('QR_WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('QR_WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('QR_WEBHOOK_SECRET')
+# Адрес Bot API; переопределяется для локального стенда (webhook_harness.py)
+TELEGRAM_API_URL = os.getenv('QR_TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+
+# Пользователи, которым доступны служебные команды (через запятую)
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('QR_ADMIN_IDS', '').split(',') if user_id.strip()}
 
-# Создаем экземпляр QR процессора
-qr_processor_instance = qr_processor.QrProcessor()
+# Ограничение частоты запросов пользователей и общей нагрузки
+admission_controller = admission.AdmissionController()
+ADMISSION_INTERVAL = float(os.getenv('QR_ADMISSION_INTERVAL', '1.0'))
+# Не чаще одного редактирования сообщения о прогрессе за этот интервал
+PROGRESS_INTERVAL = float(os.getenv('QR_PROGRESS_INTERVAL', '2.0'))
+
+# Изображения одного альбома (media group), ожидающие остальных частей
+pending_albums = {}
+ALBUM_WAIT = float(os.getenv('QR_ALBUM_WAIT', '1.5'))
+
+# Пул обработки документов (тяжелая работа выполняется вне цикла событий)
+processing_pool = workers.ProcessingPool() if DEPLOY_MODE == 'local' else None
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
     await update.message.reply_text(
-        'Привет! Я QR-код бот. Отправь мне документ (PDF, JPG, JPEG, PNG), '
-        'и я добавлю на него QR-код. Для PDF файлов QR-код будет добавлен на каждую страницу.'
+        'Привет! Я QR-код бот. Отправь мне документ (PDF, JPG, JPEG, PNG, TIFF), '
+        'и я добавлю на него QR-код. Для PDF и многостраничных TIFF файлов QR-код будет добавлен на каждую страницу.'
     )
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -55,84 +103,64 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     logger.info(f"Получен документ: {file_name} (ID: {file_id})")
 
     # Check file extension
-    allowed_extensions = ('.jpg', '.jpeg', '.png', '.pdf')
+    allowed_extensions = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.pdf')
     if not file_name.lower().endswith(allowed_extensions):
         await update.message.reply_text(
             f"Извините, я принимаю только файлы в форматах: {', '.join(allowed_extensions)}"
         )
         return
 
-    await update.message.reply_text(
-        f"Файл '{file_name}' получен. Начинаю обработку..."
-    )
+    # Изображения, отправленные альбомом, обрабатываются одной задачей
+    # (TIFF может быть многостраничным, поэтому он всегда обрабатывается отдельно)
+    if update.message.media_group_id and file_name.lower().endswith(('.jpg', '.jpeg', '.png')):
+        collect_album_item(update, context)
+        return
 
+    # Оценка объема работы по размеру файла, до его загрузки
+    pages_estimate = admission.estimate_pages(file_name, document.file_size)
+
+    session = Session()
+    work_dir = None
     try:
         # Get file from Telegram
         logger.info("Загрузка файла из Telegram...")
         file = await context.bot.get_file(file_id)
-        
-        # Save file
-        save_path = os.path.join(SAVE_DIR, file_name)
+
+        # Каждая задача хранит свои файлы в отдельном каталоге,
+        # чтобы после перезапуска ее можно было продолжить
+        work_dir = os.path.join(JOBS_DIR, f"{update.effective_chat.id}_{update.message.message_id}")
+        os.makedirs(work_dir, exist_ok=True)
+        save_path = os.path.join(work_dir, file_name)
         logger.info(f"Сохранение файла в: {save_path}")
-        await file.download_to_drive(save_path)
+        data = None
+        info = None
+        if file_name.lower().endswith('.pdf'):
+            await file.download_to_drive(save_path)
+            # Поврежденные и слишком большие PDF отклоняются до постановки в очередь,
+            # а для допуска используется точное число страниц
+            try:
+                info = await asyncio.to_thread(pdf_inspect.inspect_pdf, save_path)
+            except pdf_inspect.PdfRejected as e:
+                await update.message.reply_text(f"Не удалось принять файл '{file_name}': {e}")
+                return
+            pages_estimate = info.page_count
+        else:
+            # Изображение обрабатывается прямо из памяти; копия на диске
+            # нужна только для возобновления задачи после сбоя
+            data = bytes(await file.download_as_bytearray())
+            with open(save_path, 'wb') as source_file:
+                source_file.write(data)
         logger.info("Файл успешно сохранен")
 
-        # Create database entry
-        logger.info("Создание записи в базе данных...")
-        session = Session()
-        doc = Document(
-            name=file_name,
-            version="1.0",
-            author=str(update.effective_user.id)
+        job = create_document_job(
+            session, update, file_name,
+            source_path=save_path,
+            output_path=os.path.join(work_dir, f"qr_{file_name}"),
+            work_dir=work_dir,
+            pages_estimate=pages_estimate,
         )
-        session.add(doc)
-        session.commit()
-        logger.info(f"Запись создана с ID: {doc.id}")
-
-        # Generate QR code with document info
-        qr_content = (
-            f"Документ: {file_name}\n"
-            f"Версия: {doc.version}\n"
-            f"Автор: {doc.author}\n"
-            f"Дата: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-            f"ID: {doc.id}"
-        )
-        
-        # Path for saving result
-        output_path = os.path.join(SAVE_DIR, f"qr_{file_name}")
-        
-        # Process file based on its type
-        success = False
-        if file_name.lower().endswith('.pdf'):
-            logger.info("Начинаю обработку PDF файла...")
-            success = qr_processor_instance.process_pdf(save_path, qr_content, output_path)
-        else:
-            logger.info("Начинаю обработку изображения...")
-            success = qr_processor_instance.add_qr_to_image(save_path, qr_content, output_path)
-        
-        if success:
-            # Save QR code information
-            logger.info("Сохранение информации о QR-коде...")
-            qr = QRCode(
-                document_id=doc.id,
-                content=qr_content
-            )
-            session.add(qr)
-            session.commit()
-            logger.info("Информация о QR-коде сохранена")
-            
-            # Send processed file
-            logger.info("Отправка обработанного файла...")
-            await update.message.reply_document(
-                document=open(output_path, 'rb'),
-                caption="QR-код успешно добавлен на документ!"
-            )
-            logger.info("Файл успешно отправлен")
-        else:
-            logger.error("Не удалось найти подходящее место для QR-кода")
-            await update.message.reply_text(
-                "Не удалось найти подходящее место для QR-кода на документе."
-            )
+        work_dir = None  # теперь каталогом владеет задача
+        await admit_job(update.message, context, job, f"Файл '{file_name}'", data, info)
 
     except Exception as e:
         logger.error("Ошибка при обработке файла:", exc_info=True)
@@ -142,15 +170,308 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     finally:
         session.close()
         # Clean up temporary files
+        if work_dir and os.path.isdir(work_dir):
+            shutil.rmtree(work_dir, ignore_errors=True)
+            logger.info(f"Временный каталог удален: {work_dir}")
+
+def create_document_job(session, update: Update, name, source_path, output_path, work_dir,
+                        pages_estimate, kind=JOB_KIND_DOCUMENT):
+    """Create the Document record and its deferred processing job."""
+    # Create database entry
+    logger.info("Создание записи в базе данных...")
+    doc = Document(
+        name=name,
+        version="1.0",
+        author=str(update.effective_user.id)
+    )
+    session.add(doc)
+    session.flush()
+    logger.info(f"Запись создана с ID: {doc.id}")
+
+    # Generate QR code with document info
+    qr_content = (
+        f"Документ: {name}\n"
+        f"Версия: {doc.version}\n"
+        f"Автор: {doc.author}\n"
+        f"Дата: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"ID: {doc.id}"
+    )
+
+    # Документ и задача сохраняются одним коммитом
+    return jobs.create_job(
+        session, doc,
+        chat_id=update.effective_chat.id,
+        file_name=name,
+        source_path=source_path,
+        output_path=output_path,
+        work_dir=work_dir,
+        qr_content=qr_content,
+        state=JOB_DEFERRED,
+        pages_total=pages_estimate,
+        kind=kind,
+        claimed_by=REPLICA_ID,
+    )
+
+async def admit_job(message, context: ContextTypes.DEFAULT_TYPE, job, title, data=None, info=None) -> None:
+    """Start a new job right away or put it in the waiting queue."""
+    user_id = int(job.user_id)
+    if not admission_controller.try_admit(job.id, user_id, job.pages_total):
+        # Пользователь или бот перегружен: задача ждет, не занимая обработчики
+        position = admission_controller.defer(job.id, user_id, job.pages_total)
+        await message.reply_text(
+            f"{title} получен и поставлен в очередь, позиция: {position}"
+        )
+        return
+
+    status_message = await message.reply_text(
+        f"{title} получен. Начинаю обработку..."
+    )
+    if job.kind == JOB_KIND_DOCUMENT and job.file_name.lower().endswith('.pdf'):
+        context.application.create_task(track_progress(job.id, status_message))
+    await start_job(context.bot, job.id, user_id, data, info)
+
+def collect_album_item(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Remember an image from a media group until the whole group has arrived."""
+    key = (update.effective_chat.id, update.message.media_group_id)
+    album = pending_albums.setdefault(key, {'update': update, 'documents': []})
+    album['documents'].append(update.message.document)
+    # Telegram присылает части альбома отдельными обновлениями; альбом
+    # считается полным, когда новые части не приходят ALBUM_WAIT секунд
+    album['last_item'] = object()
+    context.application.create_task(flush_album(key, album['last_item'], context))
+
+async def flush_album(key, last_item, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Turn a complete media group into a single processing job."""
+    await asyncio.sleep(ALBUM_WAIT)
+    album = pending_albums.get(key)
+    if album is None or album['last_item'] is not last_item:
+        return
+    del pending_albums[key]
+
+    update = album['update']
+    documents = album['documents']
+    logger.info(f"Получен альбом из {len(documents)} изображений")
+
+    session = Session()
+    work_dir = os.path.join(JOBS_DIR, f"{key[0]}_album_{key[1]}")
+    try:
+        source_dir = os.path.join(work_dir, 'source')
+        os.makedirs(source_dir, exist_ok=True)
+
+        async def download(index, document):
+            file = await context.bot.get_file(document.file_id)
+            return f"{index:03d}_{document.file_name}", bytes(await file.download_as_bytearray())
+
+        logger.info("Загрузка файлов альбома из Telegram...")
+        data = await asyncio.gather(*(download(i, d) for i, d in enumerate(documents, start=1)))
+        for name, content in data:
+            with open(os.path.join(source_dir, name), 'wb') as source_file:
+                source_file.write(content)
+
+        job = create_document_job(
+            session, update, f"Альбом ({len(documents)} файлов)",
+            source_path=source_dir,
+            output_path=os.path.join(work_dir, 'output'),
+            work_dir=work_dir,
+            pages_estimate=len(documents),
+            kind=JOB_KIND_ALBUM,
+        )
+        work_dir = None  # теперь каталогом владеет задача
+        await admit_job(update.message, context, job, f"Альбом из {len(documents)} файлов", list(data))
+
+    except Exception as e:
+        logger.error("Ошибка при обработке альбома:", exc_info=True)
+        await update.message.reply_text(
+            f"Произошла ошибка при обработке альбома: {str(e)}"
+        )
+    finally:
+        session.close()
+        if work_dir and os.path.isdir(work_dir):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+async def start_job(bot, job_id, user_id, data=None, info=None) -> None:
+    """Start an admitted job: run it in the pool or hand it over to the workers."""
+    jobs.update_job(job_id, state=JOB_QUEUED)
+    if DEPLOY_MODE == 'local':
+        await execute_job(bot, job_id, user_id, data, info)
+    else:
+        # Ресурсы освобождаются при доставке результата
+        logger.info(f"Задача {job_id} поставлена в очередь обработчиков")
+
+async def admission_loop(application: Application) -> None:
+    """Start deferred jobs as soon as the limits allow."""
+    while True:
+        for job_id in admission_controller.admit_waiting():
+            job = jobs.load_job(job_id)
+            logger.info(f"Задача {job_id} допущена к обработке")
+            application.create_task(start_job(application.bot, job_id, job.user_id))
+            try:
+                status_message = await application.bot.send_message(
+                    chat_id=job.chat_id,
+                    text=f"Начинаю обработку '{job.file_name}'..."
+                )
+                if job.kind == JOB_KIND_DOCUMENT and job.file_name.lower().endswith('.pdf'):
+                    application.create_task(track_progress(job_id, status_message))
+            except Exception:
+                logger.error(f"Не удалось уведомить о начале задачи {job_id}", exc_info=True)
+        await asyncio.sleep(ADMISSION_INTERVAL)
+
+async def track_progress(job_id, status_message) -> None:
+    """Show the progress of a long job by editing its status message.
+
+    The job row is polled every PROGRESS_INTERVAL seconds, so the worker's hot
+    loop is not involved and Telegram edit limits are respected.
+    """
+    stage_names = {
+        JOB_QUEUED: "в очереди",
+        JOB_RASTERIZING: "подготовка страницы",
+        JOB_PLACING: "размещение QR-кода",
+        JOB_ASSEMBLING: "сборка документа",
+    }
+    last_text = status_message.text
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        job = jobs.load_job(job_id)
+        if job is None or job.state not in stage_names:
+            return
+        text = f"Файл '{job.file_name}': {stage_names[job.state]}"
+        if job.pages_total and job.state != JOB_QUEUED:
+            text += f", обработано страниц {job.pages_done or 0} из {job.pages_total}"
+        if text == last_text:
+            continue
+        try:
+            await status_message.edit_text(text)
+            last_text = text
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except TelegramError as e:
+            logger.warning(f"Не удалось обновить прогресс задачи {job_id}: {e}")
+
+async def execute_job(bot, job_id, user_id, data=None, info=None) -> None:
+    """Run a processing job in the pool and deliver its result."""
+    if processing_pool.mode != 'thread':
+        # Разобранный PDF используется повторно только в том же процессе
+        info = None
+    try:
+        # Готовое изображение возвращается из пула в памяти и не пишется на диск
+        _, result = await processing_pool.submit(
+            user_id, workers.run_job, job_id, data, data is not None, info
+        )
+    except Exception as e:
+        # Любая ошибка до получения результата (очередь заполнена, не загрузилась
+        # модель, упал процесс пула) освобождает ресурсы и закрывает задачу
+        admission_controller.release(job_id)
+        if isinstance(e, workers.QueueFullError):
+            logger.warning(f"Очередь обработки заполнена, задача {job_id} отклонена")
+            error = "Очередь обработки заполнена"
+            text = "Сейчас обрабатывается слишком много документов. Пожалуйста, попробуйте позже."
+        else:
+            logger.error(f"Ошибка при выполнении задачи {job_id}: {str(e)}", exc_info=True)
+            error = str(e)
+            text = "Произошла ошибка при обработке документа. Пожалуйста, попробуйте позже."
+        session = Session()
         try:
-            if os.path.exists(save_path):
-                os.remove(save_path)
-                logger.info(f"Временный файл удален: {save_path}")
-            if os.path.exists(output_path):
-                os.remove(output_path)
-                logger.info(f"Временный файл удален: {output_path}")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении временных файлов: {str(e)}", exc_info=True)
+            job = session.get(ProcessingJob, job_id)
+            jobs.finish_job(session, job, JOB_FAILED, error)
+            await bot.send_message(chat_id=job.chat_id, text=text)
+        except Exception:
+            logger.error(f"Не удалось сообщить об ошибке задачи {job_id}", exc_info=True)
+        finally:
+            session.close()
+        return
+    try:
+        await deliver_job(bot, job_id, result)
+    finally:
+        admission_controller.release(job_id)
+
+async def deliver_job(bot, job_id, result=None) -> None:
+    """Send the result of a finished job to its chat.
+
+    result - the processed image in memory; otherwise it is read from job.output_path.
+    """
+    session = Session()
+    try:
+        # Готовый результат из БД видят все экземпляры бота, отправляет его один
+        if result is None and not jobs.claim_delivery(session, job_id, REPLICA_ID):
+            return
+        job = session.get(ProcessingJob, job_id)
+        if result is not None or job.state == JOB_DELIVERING:
+            try:
+                await send_result(bot, job, result)
+            except Exception:
+                if result is None:
+                    # Доставку повторит любой экземпляр бота
+                    job.state = JOB_READY
+                    session.commit()
+                raise
+
+            # Save QR code information
+            logger.info("Сохранение информации о QR-коде...")
+            session.add(QRCode(document_id=job.document_id, content=job.qr_content))
+            jobs.finish_job(session, job, JOB_SENT)
+            admission_controller.release(job_id)
+            logger.info("Информация о QR-коде сохранена")
+        elif job.state == JOB_FAILED:
+            logger.error(f"Задача {job_id} завершилась ошибкой: {job.error}")
+            await bot.send_message(
+                chat_id=job.chat_id,
+                text="Не удалось найти подходящее место для QR-кода на документе."
+            )
+            jobs.finish_job(session, job, JOB_FAILED, job.error)
+            admission_controller.release(job_id)
+    finally:
+        session.close()
+
+async def send_result(bot, job, result=None) -> None:
+    """Send the processed document (or album) of a job to its chat."""
+    # Send processed file
+    logger.info("Отправка обработанного файла...")
+    caption = "QR-код успешно добавлен на документ!"
+    if job.kind == JOB_KIND_ALBUM:
+        if result is None:
+            result = []
+            for name in jobs.album_files(job.output_path):
+                with open(os.path.join(job.output_path, name), 'rb') as output_file:
+                    result.append((name, output_file.read()))
+        await send_album(bot, job.chat_id, result, caption)
+    else:
+        result_file = io.BytesIO(result) if result is not None else open(job.output_path, 'rb')
+        with result_file:
+            await bot.send_document(
+                chat_id=job.chat_id,
+                document=result_file,
+                filename=f"qr_{job.file_name}",
+                caption=caption
+            )
+    logger.info("Файл успешно отправлен")
+
+async def reload_model(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Switch to new YOLO weights without restarting: /reload_model <path to .pt or .onnx> (admins only)."""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("Команда доступна только администраторам.")
+        return
+    if not context.args:
+        await update.message.reply_text("Укажите путь к весам: /reload_model runs/train/exp5/weights/best.pt")
+        return
+
+    try:
+        weights_path = model_registry.request_reload(context.args[0])
+    except FileNotFoundError as e:
+        await update.message.reply_text(str(e))
+        return
+    logger.info(f"Администратор {update.effective_user.id} запросил замену весов: {weights_path}")
+
+    if processing_pool is not None and processing_pool.mode == 'thread':
+        # Модель живет в этом процессе: загружаем сразу, задачи в работе доработают на старой
+        await update.message.reply_text("Загружаю новые веса...")
+        replaced = await asyncio.to_thread(workers.get_processor().registry.reload, weights_path)
+        await update.message.reply_text(
+            "Модель заменена." if replaced else "Модель не заменена, подробности в журнале."
+        )
+    else:
+        await update.message.reply_text(
+            f"Обработчики загрузят новые веса в течение {model_registry.WATCH_INTERVAL:.0f} с."
+        )
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle text messages (when user sends something other than a file)"""
@@ -175,13 +496,105 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             "Пожалуйста, попробуйте позже или обратитесь к администратору."
         )
 
+async def send_album(bot, chat_id, files, caption) -> None:
+    """Send processed images back as albums (Telegram allows up to 10 files per album)."""
+    for start_index in range(0, len(files), 10):
+        media = [
+            InputMediaDocument(
+                media=content,
+                # Убираем порядковый номер, добавленный при сохранении
+                filename=f"qr_{name.split('_', 1)[1]}",
+                caption=caption if start_index + i == len(files) - 1 else None,
+            )
+            for i, (name, content) in enumerate(files[start_index:start_index + 10])
+        ]
+        await bot.send_media_group(chat_id=chat_id, media=media)
+
+async def delivery_loop(application: Application) -> None:
+    """Deliver results produced by separate worker processes (split mode)."""
+    in_flight = set()
+
+    async def deliver(job_id):
+        try:
+            await deliver_job(application.bot, job_id)
+        except Exception:
+            logger.error(f"Ошибка при доставке результата задачи {job_id}", exc_info=True)
+        finally:
+            in_flight.discard(job_id)
+
+    while True:
+        session = Session()
+        try:
+            job_ids = [job_id for (job_id,) in jobs.undelivered_jobs(session)]
+            # Результат мог доставить другой экземпляр бота: страницы освобождаются и здесь
+            for job_id in jobs.finished_jobs(session, admission_controller.admitted_jobs):
+                admission_controller.release(job_id)
+        finally:
+            session.close()
+        for job_id in job_ids:
+            if job_id not in in_flight:
+                in_flight.add(job_id)
+                application.create_task(deliver(job_id))
+        await asyncio.sleep(DELIVERY_INTERVAL)
+
+async def post_init(application: Application) -> None:
+    """Start processing (or result delivery) and resume jobs left over from the previous run."""
+    if processing_pool is not None:
+        processing_pool.start()
+
+    session = Session()
+    try:
+        if DEPLOY_MODE == 'local':
+            recovered = jobs.recover_jobs(session, REPLICA_ID)
+            jobs.remove_orphan_files(session, JOBS_DIR)
+        else:
+            # Прерванные задачи возвращают в очередь сами процессы-обработчики,
+            # а экземпляр бота восстанавливает только допуск своих задач
+            recovered = jobs.recover_bot_jobs(session, REPLICA_ID)
+        pending = [(job.id, job.user_id, job.state, job.pages_total or 1) for job in recovered]
+    finally:
+        session.close()
+
+    if pending:
+        logger.info(f"Незавершенных задач с прошлого запуска: {len(pending)}")
+    for job_id, user_id, state, pages in pending:
+        if state == JOB_DEFERRED:
+            admission_controller.defer(job_id, user_id, pages)
+            continue
+        admission_controller.mark_admitted(job_id, pages)
+        if DEPLOY_MODE == 'local':
+            application.create_task(execute_job(application.bot, job_id, user_id))
+
+    application.bot_data['admission_task'] = asyncio.create_task(admission_loop(application))
+    if DEPLOY_MODE != 'local':
+        application.bot_data['delivery_task'] = asyncio.create_task(delivery_loop(application))
+
+async def post_shutdown(application: Application) -> None:
+    """Stop the processing pool (or result delivery) when the application stops."""
+    for task_name in ('admission_task', 'delivery_task'):
+        task = application.bot_data.pop(task_name, None)
+        if task is not None:
+            task.cancel()
+    if processing_pool is not None:
+        processing_pool.shutdown()
+
 def main() -> None:
     """Start the bot."""
-    # Create the application and pass it your bot's token
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Create the application and pass it your bot's token.
+    # concurrent_updates позволяет обрабатывать документы разных чатов одновременно
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("reload_model", reload_model))
 
     # Add document handler
     application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
@@ -193,7 +606,19 @@ def main() -> None:
     application.add_error_handler(error_handler)
 
     # Start the Bot
-    application.run_polling()
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_URL:
+            raise RuntimeError("Для режима webhook необходимо задать QR_WEBHOOK_URL")
+        logger.info(f"Запуск в режиме webhook на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
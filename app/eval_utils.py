@@ -0,0 +1,36 @@
+import os
+import glob
+import cv2
+import numpy as np
+
+# Общие функции скриптов проверки и замеров детектора (test_onnx_parity.py,
+# quantize_onnx.py, benchmark_detector.py)
+
+# Изображения проверочной выборки по умолчанию
+VAL_IMAGES = 'dataset_yolo/val/images'
+
+
+def box_iou(box, boxes):
+    """IoU одного прямоугольника x1, y1, x2, y2 с каждым из boxes"""
+    if not len(boxes):
+        return np.zeros(0)
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def load_images(source):
+    """Загружает изображения *.jpg и *.png из каталога или один файл: список (путь, массив BGR)"""
+    paths = sorted(glob.glob(os.path.join(source, '*.jpg')) + glob.glob(os.path.join(source, '*.png'))) \
+        if os.path.isdir(source) else [source]
+    images = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is not None:
+            images.append((path, image))
+    return images
@@ -0,0 +1,129 @@
+import os
+import io
+import shutil
+import logging
+import tempfile
+import subprocess
+from PIL import Image, JpegImagePlugin
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Параметры сохранения результата (можно переопределить переменными окружения)
+# 'keep' - таблицы квантования и субдискретизация исходного JPEG: повторное
+# сжатие почти не добавляет потерь, а размер файла остается прежним
+JPEG_QUALITY = os.getenv('QR_JPEG_QUALITY', 'keep')
+JPEG_SUBSAMPLING = os.getenv('QR_JPEG_SUBSAMPLING', 'keep')  # 'keep', '4:4:4', '4:2:2', '4:2:0'
+JPEG_OPTIMIZE = os.getenv('QR_JPEG_OPTIMIZE', '0') == '1'
+# Уровень 9 по умолчанию в Pillow сжимает чертежи ненамного лучше, но в разы дольше
+PNG_COMPRESS_LEVEL = int(os.getenv('QR_PNG_COMPRESS_LEVEL', '3'))
+PNG_OPTIMIZE = os.getenv('QR_PNG_OPTIMIZE', '0') == '1'
+# 'auto' - JPEG не пересжимается целиком: заменяются только блоки MCU под QR-кодом
+# (нужен jpegtran с поддержкой -drop, иначе файл сжимается заново), 'off' - всегда заново
+JPEG_PATCH_MODE = os.getenv('QR_JPEG_PATCH', 'auto')
+JPEGTRAN = os.getenv('QR_JPEGTRAN', shutil.which('jpegtran') or '')
+JPEGTRAN_TIMEOUT = 30
+
+
+def save_options(image, image_format):
+    """Параметры сохранения для формата результата"""
+    if image_format == 'JPEG':
+        keep = isinstance(image, JpegImagePlugin.JpegImageFile)
+        options = {'optimize': JPEG_OPTIMIZE}
+        # 'keep' доступен, только если изображение прочитано из JPEG; у MPO
+        # (JPEG с дополнительными кадрами) те же таблицы передаются явно
+        if JPEG_QUALITY != 'keep':
+            options['quality'] = int(JPEG_QUALITY)
+        elif keep and image.format == 'JPEG':
+            options['quality'] = 'keep'
+        elif keep:
+            options['qtables'] = image.quantization
+        if JPEG_SUBSAMPLING != 'keep':
+            options['subsampling'] = JPEG_SUBSAMPLING
+        elif keep and image.format != 'JPEG':
+            sampling = JpegImagePlugin.get_sampling(image)
+            if sampling != -1:
+                options['subsampling'] = sampling
+        elif keep and JPEG_QUALITY != 'keep':
+            options['subsampling'] = 'keep'
+        return options
+    if image_format == 'PNG':
+        return {'compress_level': PNG_COMPRESS_LEVEL, 'optimize': PNG_OPTIMIZE}
+    if image_format == 'TIFF':
+        # Без этого TIFF теряет сжатие (скан G4 вырос бы в десятки раз) и разрешение
+        options = {}
+        compression = image.info.get('compression')
+        if compression and compression != 'raw':
+            options['compression'] = compression
+        if 'dpi' in image.info:
+            options['dpi'] = image.info['dpi']
+        return options
+    return {}
+
+
+def encode_image(image, image_format, **extra):
+    """Сохраняет изображение в памяти с настроенными параметрами формата"""
+    output = io.BytesIO()
+    image.save(output, format=image_format, **save_options(image, image_format), **extra)
+    return output.getvalue()
+
+
+def _mcu_size(image):
+    """Размер блока MCU исходного JPEG (8x8, 16x8 или 16x16 пикселей)"""
+    factors = [(h, v) for _, h, v, _ in image.layer]
+    return 8 * max(h for h, _ in factors), 8 * max(v for _, v in factors)
+
+
+def _jpegtran(*args):
+    subprocess.run([JPEGTRAN, *args], check=True, capture_output=True, timeout=JPEGTRAN_TIMEOUT)
+
+
+def patch_jpeg(data, tile, position):
+    """
+    Вставляет tile в JPEG без пересжатия всего изображения
+
+    Из исходного файла вырезаются (без декодирования) блоки MCU, которые
+    накрывает tile, в них вставляется tile, и они сжимаются с таблицами
+    квантования исходного файла. jpegtran -drop подставляет их на место,
+    остальные блоки копируются как есть, без потерь.
+
+    Returns:
+        bytes: Новый JPEG или None, если режим недоступен (результат тогда
+            нужно сохранить обычным способом)
+    """
+    if JPEG_PATCH_MODE != 'auto' or not JPEGTRAN:
+        return None
+    try:
+        source = Image.open(io.BytesIO(data))
+        if source.format != 'JPEG' or source.mode not in ('L', 'RGB'):
+            return None
+        width, height = source.size
+        mcu_width, mcu_height = _mcu_size(source)
+        x, y = position
+        if x < 0 or y < 0 or x + tile.size[0] > width or y + tile.size[1] > height:
+            return None
+        x0, y0 = x - x % mcu_width, y - y % mcu_height
+        x1 = min(width, -(-(x + tile.size[0]) // mcu_width) * mcu_width)
+        y1 = min(height, -(-(y + tile.size[1]) // mcu_height) * mcu_height)
+
+        with tempfile.TemporaryDirectory(prefix="qr_jpeg_") as temp_dir:
+            source_path = os.path.join(temp_dir, 'source.jpg')
+            region_path = os.path.join(temp_dir, 'region.jpg')
+            patch_path = os.path.join(temp_dir, 'patch.jpg')
+            output_path = os.path.join(temp_dir, 'output.jpg')
+            with open(source_path, 'wb') as f:
+                f.write(data)
+
+            _jpegtran('-copy', 'none', '-crop', f"{x1 - x0}x{y1 - y0}+{x0}+{y0}", '-outfile', region_path, source_path)
+            with Image.open(region_path) as region:
+                region = region.convert(source.mode)
+            region.paste(tile.convert(source.mode), (x - x0, y - y0))
+            region.save(patch_path, format='JPEG', qtables=source.quantization,
+                        subsampling=JpegImagePlugin.get_sampling(source))
+
+            _jpegtran('-copy', 'all', '-drop', f"+{x0}+{y0}", patch_path, '-outfile', output_path, source_path)
+            with open(output_path, 'rb') as f:
+                return f.read()
+    except Exception as e:
+        logger.warning(f"Не удалось заменить блоки JPEG через jpegtran, файл будет сжат заново: {str(e)}")
+        return None
@@ -0,0 +1,222 @@
+import os
+import time
+import queue
+import bisect
+import logging
+import threading
+import numpy as np
+from concurrent.futures import Future
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Параметры микропакетов (можно переопределить переменными окружения)
+# Сколько ждать других запросов после первого, прежде чем запускать сеть, секунд
+MAX_WAIT = float(os.getenv('QR_INFERENCE_MAX_WAIT', '0.005'))
+# Как часто писать гистограммы в журнал, секунд
+STATS_INTERVAL = float(os.getenv('QR_INFERENCE_STATS_INTERVAL', '300'))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+QUEUE_WAIT_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5, 1.0)
+
+_STOP = object()
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин
+
+    Значение попадает в первую корзину, граница которой не меньше его;
+    snapshot() возвращает накопленные счетчики, как в Prometheus.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {'buckets': [(граница, число значений не больше нее), ...], 'count': ..., 'sum': ...};
+                последняя граница - float('inf')
+        """
+        with self._lock:
+            counts = list(self._counts)
+            count, total = self._count, self._sum
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'count': count, 'sum': total}
+
+    def format(self, scale=1, unit=''):
+        """Строка для журнала: число значений в каждой корзине (не накопленное)"""
+        snapshot = self.snapshot()
+        parts = []
+        previous = 0
+        for bound, running in snapshot['buckets']:
+            label = '+inf' if bound == float('inf') else f"{bound * scale:g}{unit}"
+            parts.append(f"<={label}: {running - previous}")
+            previous = running
+        mean = snapshot['sum'] / snapshot['count'] if snapshot['count'] else 0
+        return f"{', '.join(parts)} (всего {snapshot['count']}, среднее {mean * scale:.2f}{unit})"
+
+
+class InferenceServer:
+    """
+    Общий для всех задач процесса вход в детектор с микропакетами
+
+    Задачи пула потоков бота отправляют изображения в одну очередь. Пакеты
+    собираются только внутри процесса: обработчики app.workers и пул
+    процессов выполняют по одной задаче и сервер не запускают. Поток
+    сервера берет первый запрос, ждет остальные не дольше max_wait и
+    прогоняет через сеть все накопившиеся (не больше max_batch) одним
+    пакетом, а результаты возвращает через Future. Одиночные изображения от
+    разных пользователей так обрабатываются вместе, а не по одному.
+
+    Объект подменяет YOLODetector: find_empty_space, find_empty_spaces и
+    остальные атрибуты детектора (weights_hash и т.п.) доступны как у него.
+    После close() запросы выполняются напрямую в вызывающем потоке, поэтому
+    задачи, закрепившие старую модель, доработают и после ее замены.
+    """
+
+    def __init__(self, detector, max_batch=None, max_wait=MAX_WAIT, stats_interval=STATS_INTERVAL):
+        """
+        Args:
+            detector (YOLODetector): Детектор, которому передаются пакеты
+            max_batch (int): Максимальный размер пакета (по умолчанию detector.max_batch_size)
+            max_wait (float): Максимальное ожидание других запросов после первого, секунд
+            stats_interval (float): Период записи гистограмм в журнал, секунд
+        """
+        self.detector = detector
+        self.max_batch = max(1, max_batch or detector.max_batch_size)
+        self.max_wait = max_wait
+        self.stats_interval = stats_interval
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_waits = Histogram(QUEUE_WAIT_BUCKETS)
+        self._requests = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._serve, name='inference_server', daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        # Вызывается только для атрибутов, которых нет у сервера
+        return getattr(self.detector, name)
+
+    def submit(self, image, qr_size=None):
+        """
+        Ставит изображение в очередь детекции
+
+        Returns:
+            Future: Результат - (x, y) или None, как у YOLODetector.find_empty_space
+        """
+        future = Future()
+        with self._lock:
+            if not self._closed:
+                self._requests.put((image, qr_size, time.monotonic(), future))
+                return future
+        try:
+            future.set_result(self.detector.find_empty_spaces([image], qr_size)[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def find_empty_space(self, image_path, qr_size=None):
+        """См. YOLODetector.find_empty_space"""
+        if not isinstance(image_path, np.ndarray):
+            return self.detector.find_empty_space(image_path, qr_size)
+        return self.submit(image_path, qr_size).result()
+
+    def find_empty_spaces(self, images, qr_size=None):
+        """
+        См. YOLODetector.find_empty_spaces
+
+        Изображения ставятся в общую очередь по одному и могут попасть в один
+        пакет с запросами других задач.
+        """
+        qr_sizes = qr_size if isinstance(qr_size, (list, tuple)) else [qr_size] * len(images)
+        futures = [self.submit(image, size) for image, size in zip(images, qr_sizes)]
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        """
+        Собирает пакет запросов
+
+        Returns:
+            tuple: (список запросов, получен ли сигнал остановки)
+        """
+        request = self._requests.get()
+        if request is _STOP:
+            return [], True
+        batch = [request]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                # Уже стоящие в очереди запросы забираются и после истечения ожидания
+                request = self._requests.get(timeout=remaining) if remaining > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run_batch(self, batch):
+        started = time.monotonic()
+        self.batch_sizes.observe(len(batch))
+        for _, _, submitted, _ in batch:
+            self.queue_waits.observe(started - submitted)
+        try:
+            positions = self.detector.find_empty_spaces([image for image, _, _, _ in batch],
+                                                        [qr_size for _, qr_size, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Ошибка детекции пакета из {len(batch)} изображений: {str(e)}", exc_info=True)
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, _, future), position in zip(batch, positions):
+            future.set_result(position)
+
+    def _serve(self):
+        last_stats = time.monotonic()
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if batch:
+                self._run_batch(batch)
+            if time.monotonic() - last_stats >= self.stats_interval:
+                self.log_stats()
+                last_stats = time.monotonic()
+
+    def stats(self):
+        """Гистограммы размера пакета и ожидания в очереди (секунды), см. Histogram.snapshot"""
+        return {'batch_size': self.batch_sizes.snapshot(), 'queue_wait': self.queue_waits.snapshot()}
+
+    def log_stats(self):
+        if not self.batch_sizes.snapshot()['count']:
+            return
+        logger.info(f"Размер пакетов детектора: {self.batch_sizes.format()}")
+        logger.info(f"Ожидание в очереди детектора: {self.queue_waits.format(scale=1000, unit=' мс')}")
+
+    def close(self):
+        """Останавливает поток после обработки уже поставленных запросов"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._requests.put(_STOP)
+        self._thread.join()
+        self.log_stats()
@@ -0,0 +1,291 @@
+import os
+import shutil
+import logging
+import threading
+from sqlalchemy.orm import sessionmaker
+
+from .models import (
+    ProcessingJob, init_db,
+    JOB_DEFERRED, JOB_QUEUED, JOB_RASTERIZING, JOB_PLACING, JOB_ASSEMBLING, JOB_READY, JOB_DELIVERING,
+    JOB_SENT, JOB_FAILED,
+    JOB_ACTIVE_STATES, JOB_KIND_DOCUMENT,
+)
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Состояния, в которых задача находилась в работе у обработчика
+IN_PROGRESS_STATES = (JOB_RASTERIZING, JOB_PLACING, JOB_ASSEMBLING)
+
+_session_factory = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Создает сессию БД для текущего процесса (пул процессов не может использовать сессии бота)"""
+    global _session_factory
+    with _session_lock:
+        if _session_factory is None:
+            _session_factory = sessionmaker(bind=init_db())
+    return _session_factory()
+
+
+def create_job(session, document, chat_id, file_name, source_path, output_path, work_dir, qr_content,
+               state=JOB_QUEUED, pages_total=None, kind=JOB_KIND_DOCUMENT, claimed_by=None):
+    """
+    Создает задачу обработки документа (в состоянии queued или deferred)
+
+    Для альбома source_path и output_path - каталоги с файлами изображений.
+    В режиме local claimed_by - экземпляр бота, который выполняет задачу.
+    """
+    job = ProcessingJob(
+        document_id=document.id,
+        kind=kind,
+        chat_id=chat_id,
+        user_id=document.author,
+        file_name=file_name,
+        source_path=source_path,
+        output_path=output_path,
+        work_dir=work_dir,
+        qr_content=qr_content,
+        state=state,
+        pages_total=pages_total,
+        claimed_by=claimed_by,
+    )
+    session.add(job)
+    session.commit()
+    logger.info(f"Создана задача обработки {job.id} для документа {document.id}")
+    return job
+
+
+def album_files(directory):
+    """Имена файлов альбома в порядке отправки (имена начинаются с порядкового номера)"""
+    return sorted(os.listdir(directory))
+
+
+def load_job(job_id):
+    """Загружает задачу в отдельной сессии и возвращает отсоединенный объект"""
+    session = get_session()
+    try:
+        job = session.get(ProcessingJob, job_id)
+        if job is not None:
+            session.expunge(job)
+        return job
+    finally:
+        session.close()
+
+
+def update_job(job_id, **fields):
+    """Обновляет поля задачи (state, pages_done, pages_total, error)"""
+    session = get_session()
+    try:
+        session.query(ProcessingJob).filter(ProcessingJob.id == job_id).update(fields)
+        session.commit()
+    finally:
+        session.close()
+
+
+def claim_next_job(worker_name):
+    """
+    Атомарно забирает самую старую задачу из очереди
+
+    Returns:
+        int: ID задачи или None, если очередь пуста
+    """
+    session = get_session()
+    try:
+        while True:
+            candidate = (
+                session.query(ProcessingJob.id)
+                .filter(ProcessingJob.state == JOB_QUEUED)
+                .order_by(ProcessingJob.id)
+                .first()
+            )
+            if candidate is None:
+                return None
+            job_id = candidate[0]
+            # Условие на state не дает двум обработчикам забрать одну задачу
+            claimed = (
+                session.query(ProcessingJob)
+                .filter(ProcessingJob.id == job_id, ProcessingJob.state == JOB_QUEUED)
+                .update({'state': JOB_RASTERIZING, 'claimed_by': worker_name},
+                        synchronize_session=False)
+            )
+            session.commit()
+            if claimed:
+                return job_id
+    finally:
+        session.close()
+
+
+def requeue_jobs(session, claimed_by=None, release=True):
+    """
+    Возвращает прерванные задачи в очередь
+
+    Задачи, прерванные посреди обработки, переходят в состояние queued:
+    обработчик продолжит их с последней готовой страницы.
+
+    Args:
+        claimed_by (str): Вернуть только задачи указанного обработчика
+        release (bool): Снять отметку обработчика, чтобы задачу мог забрать любой
+    """
+    query = session.query(ProcessingJob).filter(ProcessingJob.state.in_(IN_PROGRESS_STATES))
+    if claimed_by is not None:
+        query = query.filter(ProcessingJob.claimed_by == claimed_by)
+    jobs = query.all()
+    for job in jobs:
+        logger.info(f"Задача {job.id} была прервана в состоянии {job.state}, "
+                    f"готово страниц: {job.pages_done or 0}")
+        job.state = JOB_QUEUED
+        if release:
+            job.claimed_by = None
+    session.commit()
+    return len(jobs)
+
+
+def _unfinished():
+    return (
+        ProcessingJob.state.in_(JOB_ACTIVE_STATES)
+        | ((ProcessingJob.state == JOB_FAILED) & ~ProcessingJob.notified)
+    )
+
+
+def _release_deliveries(session, owner):
+    """Возвращает в состояние ready задачи, доставка которых прервалась остановкой экземпляра owner"""
+    session.query(ProcessingJob) \
+        .filter(ProcessingJob.state == JOB_DELIVERING, ProcessingJob.claimed_by == owner) \
+        .update({'state': JOB_READY}, synchronize_session=False)
+
+
+def recover_jobs(session, owner=None):
+    """
+    Возвращает в очередь прерванные задачи и возвращает все незавершенные
+
+    Args:
+        owner (str): Экземпляр бота (режим local). Задачи других экземпляров
+            с общей БД не трогаются: их файлы и ожидающие альбомы есть только там.
+            Незавершенные задачи без владельца (созданные до появления отметки)
+            забирает первый запустившийся экземпляр
+    """
+    if owner is not None:
+        _release_deliveries(session, owner)
+        # Условие на claimed_by не дает двум экземплярам забрать одну задачу
+        session.query(ProcessingJob).filter(_unfinished(), ProcessingJob.claimed_by.is_(None)) \
+            .update({'claimed_by': owner}, synchronize_session=False)
+        session.commit()
+    requeue_jobs(session, claimed_by=owner, release=owner is None)
+    return active_jobs(session, owner)
+
+
+def recover_bot_jobs(session, owner):
+    """
+    Задачи экземпляра бота owner в режиме split: ожидающие допуска и еще не взятые обработчиками
+
+    Задачи в работе возвращают в очередь сами обработчики, а готовые результаты
+    доставляет любой экземпляр (claim_delivery). Ожидающие допуска задачи без
+    владельца (созданные до появления отметки) забирает первый запустившийся экземпляр.
+    """
+    _release_deliveries(session, owner)
+    session.query(ProcessingJob) \
+        .filter(ProcessingJob.state == JOB_DEFERRED, ProcessingJob.claimed_by.is_(None)) \
+        .update({'claimed_by': owner}, synchronize_session=False)
+    session.commit()
+    return (
+        session.query(ProcessingJob)
+        .filter(ProcessingJob.state.in_((JOB_DEFERRED, JOB_QUEUED)), ProcessingJob.claimed_by == owner)
+        .order_by(ProcessingJob.id)
+        .all()
+    )
+
+
+def active_jobs(session, owner=None):
+    """Незавершенные задачи, а также ошибки, о которых пользователь еще не узнал"""
+    query = session.query(ProcessingJob).filter(_unfinished())
+    if owner is not None:
+        query = query.filter(ProcessingJob.claimed_by == owner)
+    return query.order_by(ProcessingJob.id).all()
+
+
+def undelivered_jobs(session):
+    """Задачи, результат которых готов, но еще не доставлен пользователю"""
+    return (
+        session.query(ProcessingJob.id)
+        .filter(
+            (ProcessingJob.state == JOB_READY)
+            | ((ProcessingJob.state == JOB_FAILED) & ~ProcessingJob.notified)
+        )
+        .order_by(ProcessingJob.id)
+        .all()
+    )
+
+
+def claim_delivery(session, job_id, owner):
+    """
+    Атомарно забирает доставку результата или сообщения об ошибке задачи
+
+    Готовая задача переходит в состояние delivering, у ошибки сразу отмечается
+    notified, поэтому при нескольких экземплярах бота пользователь получает
+    результат один раз.
+
+    Returns:
+        bool: True, если доставка досталась экземпляру owner
+    """
+    claimed = (
+        session.query(ProcessingJob)
+        .filter(ProcessingJob.id == job_id, ProcessingJob.state == JOB_READY)
+        .update({'state': JOB_DELIVERING, 'claimed_by': owner}, synchronize_session=False)
+    )
+    if not claimed:
+        # Об ошибке сообщается не больше одного раза, даже если отправка не удастся
+        claimed = (
+            session.query(ProcessingJob)
+            .filter(ProcessingJob.id == job_id, ProcessingJob.state == JOB_FAILED, ~ProcessingJob.notified)
+            .update({'notified': True}, synchronize_session=False)
+        )
+    session.commit()
+    return bool(claimed)
+
+
+def finished_jobs(session, job_ids):
+    """ID завершенных задач из job_ids (в том числе доставленных другим экземпляром бота)"""
+    if not job_ids:
+        return []
+    return [
+        job_id for (job_id,) in session.query(ProcessingJob.id).filter(
+            ProcessingJob.id.in_(list(job_ids)),
+            (ProcessingJob.state == JOB_SENT) | ((ProcessingJob.state == JOB_FAILED) & ProcessingJob.notified),
+        )
+    ]
+
+
+def remove_job_files(job):
+    """Удаляет рабочий каталог задачи"""
+    if job.work_dir and os.path.isdir(job.work_dir):
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+        logger.info(f"Рабочий каталог задачи {job.id} удален: {job.work_dir}")
+
+
+def remove_orphan_files(session, jobs_dir):
+    """Удаляет каталоги задач, которые уже завершены или отсутствуют в БД"""
+    if not os.path.isdir(jobs_dir):
+        return
+    active_dirs = {
+        os.path.abspath(work_dir)
+        for (work_dir,) in session.query(ProcessingJob.work_dir)
+        .filter(ProcessingJob.state.in_(JOB_ACTIVE_STATES))
+    }
+    for name in os.listdir(jobs_dir):
+        path = os.path.abspath(os.path.join(jobs_dir, name))
+        if path not in active_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info(f"Удален оставшийся каталог задачи: {path}")
+
+
+def finish_job(session, job, state, error=None):
+    """Переводит задачу в конечное состояние (sent или failed) и удаляет ее файлы"""
+    assert state in (JOB_SENT, JOB_FAILED)
+    job.state = state
+    job.error = error
+    job.notified = True
+    session.commit()
+    remove_job_files(job)
@@ -0,0 +1,170 @@
+import os
+import glob
+import logging
+import threading
+import numpy as np
+
+from .yolo_detector import YOLODetector, PROJECT_ROOT
+from .inference_server import InferenceServer
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Параметры модели (можно переопределить переменными окружения)
+# Веса .onnx (export_onnx.py) выполняются через ONNX Runtime
+WEIGHTS_PATH = os.getenv('QR_YOLO_WEIGHTS', 'runs/train/exp4/weights/best.pt')
+# Каталог, в который выкладываются новые веса: подхватывается самый свежий *.pt или *.onnx
+WEIGHTS_WATCH_DIR = os.getenv('QR_WEIGHTS_WATCH_DIR')
+# Файл с путем к весам, которые нужно загрузить (пишется командой /reload_model)
+WEIGHTS_POINTER = os.getenv('QR_WEIGHTS_POINTER', os.path.join(PROJECT_ROOT, 'active_weights.txt'))
+WATCH_INTERVAL = float(os.getenv('QR_WEIGHTS_WATCH_INTERVAL', '10'))
+# Максимальный размер пакета изображений за один проход сети
+DETECT_MAX_BATCH = int(os.getenv('QR_DETECT_MAX_BATCH', '8'))
+# '1' - запросы задач, одновременно выполняемых в пуле потоков бота, объединяются
+# в микропакеты (см. InferenceServer). Процесс, выполняющий по одной задаче
+# (app.workers в режиме split, пул процессов), сервер не запускает
+INFERENCE_BATCHING = os.getenv('QR_INFERENCE_BATCHING', '1') == '1'
+# Потоки ONNX Runtime; в режиме процессов имеет смысл делить ядра между обработчиками
+ONNX_INTRA_OP_THREADS = int(os.getenv('QR_ONNX_INTRA_OP_THREADS', '0'))
+ONNX_INTER_OP_THREADS = int(os.getenv('QR_ONNX_INTER_OP_THREADS', '0'))
+
+
+def _resolve(path):
+    return path if os.path.isabs(path) else os.path.join(PROJECT_ROOT, path)
+
+
+def request_reload(weights_path):
+    """
+    Просит все процессы перейти на новые веса
+
+    Путь записывается в файл-указатель, который отслеживает каждый ModelRegistry.
+    """
+    weights_path = _resolve(weights_path)
+    if not os.path.isfile(weights_path):
+        raise FileNotFoundError(f"Файл весов не найден: {weights_path}")
+    temp_path = f"{WEIGHTS_POINTER}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(weights_path)
+    os.replace(temp_path, WEIGHTS_POINTER)
+    return weights_path
+
+
+class ModelRegistry:
+    """
+    Текущая модель детектора с горячей заменой весов
+
+    Новые веса загружаются и прогреваются в фоне, после чего атомарно подменяют
+    текущий детектор. Задачи, уже получившие детектор через get(), доводят работу
+    на старой модели: она освобождается, когда на нее не остается ссылок.
+    """
+
+    def __init__(self, weights_path=WEIGHTS_PATH, watch_dir=WEIGHTS_WATCH_DIR,
+                 pointer_path=WEIGHTS_POINTER, device='', batching=INFERENCE_BATCHING):
+        self.weights_path = _resolve(weights_path)
+        self.watch_dir = watch_dir
+        self.pointer_path = pointer_path
+        self.device = device
+        self.batching = batching
+        self._detector = None
+        self._loaded_version = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _version(path):
+        """Версия файла весов: путь и время изменения"""
+        return (os.path.abspath(path), os.path.getmtime(path))
+
+    def _load(self, weights_path):
+        """Загружает и прогревает детектор, чтобы первая задача не ждала инициализации"""
+        detector = YOLODetector(weights_path=weights_path, device=self.device, max_batch_size=DETECT_MAX_BATCH,
+                                intra_op_threads=ONNX_INTRA_OP_THREADS, inter_op_threads=ONNX_INTER_OP_THREADS)
+        detector.find_empty_spaces([np.full((640, 640, 3), 255, dtype=np.uint8)])
+        return InferenceServer(detector) if self.batching else detector
+
+    @staticmethod
+    def _retire(detector):
+        """Останавливает сервер замененной модели; закрепившие ее задачи продолжат вызывать ее напрямую"""
+        if isinstance(detector, InferenceServer):
+            detector.close()
+
+    def get(self):
+        """Возвращает текущий детектор (при первом обращении загружает его)"""
+        with self._lock:
+            detector = self._detector
+        if detector is not None:
+            return detector
+        with self._reload_lock:
+            if self._detector is None:
+                weights_path = self._desired_weights() or self.weights_path
+                detector = self._load(weights_path)
+                with self._lock:
+                    self._detector = detector
+                    self._loaded_version = self._version(weights_path)
+                logger.info(f"YOLO детектор загружен: {weights_path}")
+            return self._detector
+
+    def reload(self, weights_path=None):
+        """
+        Загружает новые веса и подменяет ими текущий детектор
+
+        Returns:
+            bool: True, если модель заменена
+        """
+        weights_path = _resolve(weights_path) if weights_path else (self._desired_weights() or self.weights_path)
+        with self._reload_lock:
+            version = self._version(weights_path)
+            if version == self._loaded_version:
+                return False
+            logger.info(f"Загрузка новых весов модели: {weights_path}")
+            try:
+                detector = self._load(weights_path)
+            except Exception as e:
+                logger.error(f"Не удалось загрузить веса {weights_path}, остается прежняя модель: {str(e)}",
+                             exc_info=True)
+                return False
+            with self._lock:
+                previous = self._detector
+                self._detector = detector
+                self._loaded_version = version
+            if previous is not None:
+                self._retire(previous)
+            logger.info(f"Модель заменена на {weights_path}")
+            return True
+
+    def _desired_weights(self):
+        """Веса, которые должны быть загружены: из файла-указателя или самые свежие в watch_dir"""
+        if self.pointer_path and os.path.isfile(self.pointer_path):
+            with open(self.pointer_path, 'r', encoding='utf-8') as f:
+                path = f.read().strip()
+            if path and os.path.isfile(path):
+                return path
+        if self.watch_dir and os.path.isdir(self.watch_dir):
+            candidates = glob.glob(os.path.join(self.watch_dir, '*.pt')) + \
+                glob.glob(os.path.join(self.watch_dir, '*.onnx'))
+            if candidates:
+                return max(candidates, key=os.path.getmtime)
+        return None
+
+    def start_watching(self, interval=WATCH_INTERVAL):
+        """Запускает фоновую проверку новых весов"""
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop_event.wait(interval):
+                try:
+                    weights_path = self._desired_weights()
+                    if weights_path and self._detector is not None \
+                            and self._version(weights_path) != self._loaded_version:
+                        self.reload(weights_path)
+                except Exception as e:
+                    logger.error(f"Ошибка при проверке новых весов: {str(e)}", exc_info=True)
+
+        self._watcher = threading.Thread(target=watch, name='weights_watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop_event.set()
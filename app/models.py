@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, DateTime, Text
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, Boolean, ForeignKey, DateTime, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -16,6 +16,7 @@ class Document(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     qr_codes = relationship("QRCode", back_populates="document")
     history = relationship("DocumentHistory", back_populates="document")
+    jobs = relationship("ProcessingJob", back_populates="document")
 
 class QRCode(Base):
     __tablename__ = 'qr_codes'
@@ -38,8 +39,53 @@ class DocumentHistory(Base):
     changed_at = Column(DateTime, default=datetime.utcnow)
     document = relationship("Document", back_populates="history")
 
+# Состояния задачи обработки
+JOB_DEFERRED = 'deferred'  # ждет допуска к обработке (лимиты пользователя или нагрузки)
+JOB_QUEUED = 'queued'
+JOB_RASTERIZING = 'rasterizing'
+JOB_PLACING = 'placing'
+JOB_ASSEMBLING = 'assembling'
+JOB_READY = 'ready'  # результат готов, но еще не отправлен пользователю
+JOB_DELIVERING = 'delivering'  # результат отправляет экземпляр бота claimed_by
+JOB_SENT = 'sent'
+JOB_FAILED = 'failed'
+
+# Вид задачи: один документ или альбом изображений (media group)
+JOB_KIND_DOCUMENT = 'document'
+JOB_KIND_ALBUM = 'album'
+
+JOB_ACTIVE_STATES = (JOB_DEFERRED, JOB_QUEUED, JOB_RASTERIZING, JOB_PLACING, JOB_ASSEMBLING, JOB_READY,
+                     JOB_DELIVERING)
+
+class ProcessingJob(Base):
+    __tablename__ = 'processing_jobs'
+
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey('documents.id'))
+    kind = Column(String, default=JOB_KIND_DOCUMENT, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    user_id = Column(String)
+    file_name = Column(String, nullable=False)
+    source_path = Column(String, nullable=False)
+    output_path = Column(String, nullable=False)
+    work_dir = Column(String, nullable=False)
+    qr_content = Column(Text, nullable=False)
+    state = Column(String, default=JOB_QUEUED, nullable=False, index=True)
+    pages_total = Column(Integer)
+    pages_done = Column(Integer, default=0)
+    error = Column(Text)
+    claimed_by = Column(String)  # обработчик, взявший задачу, или экземпляр бота, создавший или доставляющий ее
+    notified = Column(Boolean, default=False)  # пользователь получил результат или сообщение об ошибке
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    document = relationship("Document", back_populates="jobs")
+
 # Создание базы данных
 def init_db():
-    engine = create_engine('sqlite:///documents.db')
+    # База используется из нескольких потоков и процессов обработки
+    engine = create_engine(
+        'sqlite:///documents.db',
+        connect_args={'check_same_thread': False, 'timeout': 30}
+    )
     Base.metadata.create_all(engine)
     return engine 
\ No newline at end of file
@@ -0,0 +1,92 @@
+import os
+import ast
+import json
+import logging
+import numpy as np
+import torch
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Отчет проверки точности квантованной модели лежит рядом с ней (пишет quantize_onnx.py)
+GATE_REPORT_SUFFIX = '.gate.json'
+
+
+def check_quantization_gate(weights_path, weights_hash):
+    """
+    Проверяет, что квантованные веса прошли проверку точности quantize_onnx.py
+
+    Raises:
+        ValueError: Отчета нет, он относится к другому файлу или проверка не пройдена
+    """
+    report_path = weights_path + GATE_REPORT_SUFFIX
+    if not os.path.isfile(report_path):
+        raise ValueError(f"Квантованные веса {weights_path} не проверены: запустите quantize_onnx.py --evaluate-only")
+    with open(report_path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    if report.get('weights_hash') != weights_hash:
+        raise ValueError(f"Отчет {report_path} относится к другой версии весов, повторите проверку")
+    if not report.get('passed'):
+        raise ValueError(
+            f"Квантованные веса {weights_path} не прошли проверку точности: "
+            f"mAP@0.5 empty_space {report['int8']['map50']:.3f} против {report['fp32']['map50']:.3f}, "
+            f"совпадение мест {report['placement_agreement']:.1%}"
+        )
+
+
+class OnnxModel:
+    """
+    Модель YOLOv5, экспортированная в ONNX (export_onnx.py), на ONNX Runtime
+
+    Вызывается так же, как DetectMultiBackend: тензор NCHW (float, 0..1) ->
+    тензор предсказаний для non_max_suppression. Работает только на CPU.
+    """
+
+    def __init__(self, weights_path, intra_op_threads=0, inter_op_threads=0):
+        """
+        Args:
+            weights_path (str): Путь к файлу .onnx
+            intra_op_threads (int): Потоков внутри одного оператора (0 - по числу ядер)
+            inter_op_threads (int): Потоков для независимых операторов (0 - по умолчанию ONNX Runtime)
+        """
+        # onnxruntime нужен только для весов .onnx
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self.session = ort.InferenceSession(weights_path, sess_options=options, providers=['CPUExecutionProvider'])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.output_name = self.session.get_outputs()[0].name
+        self.input_dtype = np.float16 if model_input.type == 'tensor(float16)' else np.float32
+        # Модель, экспортированная без --dynamic, принимает по одному изображению
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+
+        # stride и имена классов export.py из YOLOv5 записывает в метаданные модели
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if 'names' not in metadata:
+            raise ValueError(f"В {weights_path} нет имен классов, экспортируйте веса через export_onnx.py")
+        self.stride = int(metadata.get('stride', 32))
+        self.names = ast.literal_eval(metadata['names'])
+        # quantize_onnx.py отмечает квантованные модели ('int8')
+        self.quantization = metadata.get('quantization')
+        logger.info(
+            f"ONNX Runtime: {weights_path}, потоков intra_op={intra_op_threads or 'авто'}, "
+            f"inter_op={inter_op_threads or 'авто'}"
+        )
+
+    def __call__(self, img):
+        data = img.cpu().numpy().astype(self.input_dtype, copy=False)
+        if self.dynamic_batch or len(data) == 1:
+            pred = self.session.run([self.output_name], {self.input_name: data})[0]
+        else:
+            pred = np.concatenate([
+                self.session.run([self.output_name], {self.input_name: data[i:i + 1]})[0]
+                for i in range(len(data))
+            ])
+        return torch.from_numpy(pred.astype(np.float32, copy=False))
@@ -0,0 +1,132 @@
+import os
+import logging
+import cv2
+import numpy as np
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Параметры сравнения страниц (можно переопределить переменными окружения)
+FINGERPRINT_SIZE = 16  # отпечаток - 16x16 бит
+MAX_DISTANCE = int(os.getenv('QR_LAYOUT_MAX_DISTANCE', '8'))  # допустимое число различающихся бит
+MAX_CACHED_LAYOUTS = int(os.getenv('QR_LAYOUT_CACHE_SIZE', '500'))
+# Доля темных пикселей, при которой место под QR-код уже не считается пустым
+MAX_INK_RATIO = float(os.getenv('QR_LAYOUT_MAX_INK', '0.005'))
+
+
+def page_fingerprint(image):
+    """
+    Перцептивный отпечаток страницы (dHash): знаки разностей соседних пикселей
+    уменьшенного изображения в оттенках серого
+
+    Args:
+        image (np.ndarray): Изображение в формате BGR
+
+    Returns:
+        int: Отпечаток из FINGERPRINT_SIZE * FINGERPRINT_SIZE бит
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    thumb = cv2.resize(gray, (FINGERPRINT_SIZE + 1, FINGERPRINT_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def is_blank(image, position, qr_size):
+    """Проверяет, что под QR-кодом на этой странице действительно пусто"""
+    x, y = position
+    height, width = image.shape[:2]
+    if x < 0 or y < 0 or x + qr_size > width or y + qr_size > height:
+        return False
+    region = image[y:y + qr_size, x:x + qr_size]
+    ink = np.count_nonzero(region.min(axis=2) < 200)
+    return ink <= MAX_INK_RATIO * qr_size * qr_size
+
+
+class PageLayouts:
+    """
+    Повторное использование мест QR-кода для страниц с одинаковой компоновкой
+
+    В комплектах чертежей на каждом листе повторяется одна и та же рамка
+    и основная надпись. Если отпечаток страницы почти совпадает с отпечатком
+    уже обработанной страницы (этой же задачи или, через кэш, предыдущих задач),
+    берется ее место, а детекция пропускается. Место используется, только если
+    на новой странице под ним действительно пусто.
+
+    Объект используется одной задачей из одного потока.
+    """
+
+    def __init__(self, cache=None, cache_key=None):
+        """
+        Args:
+            cache (ResultCache): Кэш для обмена компоновками между задачами
+            cache_key (str): Ключ записи в кэше (зависит от весов модели и DPI)
+        """
+        self.cache = cache
+        self.cache_key = cache_key
+        self._job_layouts = []
+        self._cached_layouts = None
+        self.job_hits = 0
+        self.cache_hits = 0
+        self.misses = 0
+
+    def _load_cached(self):
+        if self._cached_layouts is None:
+            entries = self.cache.get_layouts(self.cache_key) if self.cache and self.cache_key else None
+            self._cached_layouts = entries or []
+        return self._cached_layouts
+
+    @staticmethod
+    def _match(layouts, fingerprint, shape, image, qr_size):
+        for entry in reversed(layouts):
+            if tuple(entry['shape']) != shape:
+                continue
+            if bin(entry['fingerprint'] ^ fingerprint).count('1') > MAX_DISTANCE:
+                continue
+            position = tuple(entry['position'])
+            if is_blank(image, position, qr_size):
+                return position
+        return None
+
+    def find(self, image, qr_size):
+        """
+        Ищет место по страницам с такой же компоновкой
+
+        Returns:
+            tuple: (отпечаток, позиция (x, y) или None)
+        """
+        fingerprint = page_fingerprint(image)
+        shape = tuple(image.shape[:2])
+        position = self._match(self._job_layouts, fingerprint, shape, image, qr_size)
+        if position is not None:
+            self.job_hits += 1
+            return fingerprint, position
+        position = self._match(self._load_cached(), fingerprint, shape, image, qr_size)
+        if position is not None:
+            self.cache_hits += 1
+            return fingerprint, position
+        self.misses += 1
+        return fingerprint, None
+
+    def add(self, fingerprint, image, position):
+        """Запоминает место, найденное детектором"""
+        self._job_layouts.append({
+            'fingerprint': fingerprint,
+            'shape': list(image.shape[:2]),
+            'position': list(position),
+        })
+
+    def save(self):
+        """Добавляет компоновки этой задачи в кэш (хранятся последние MAX_CACHED_LAYOUTS)"""
+        if not self.cache or not self.cache_key or not self._job_layouts:
+            return
+        layouts = self._load_cached() + self._job_layouts
+        self.cache.put_layouts(self.cache_key, layouts[-MAX_CACHED_LAYOUTS:])
+
+    def log_stats(self):
+        total = self.job_hits + self.cache_hits + self.misses
+        if total:
+            logger.info(
+                f"Компоновка страниц: совпадений в задаче {self.job_hits}, из кэша {self.cache_hits}, "
+                f"детекций {self.misses} из {total} "
+                f"(пропущено {(self.job_hits + self.cache_hits) / total:.0%})"
+            )
@@ -0,0 +1,142 @@
+import os
+import logging
+from PyPDF2 import PdfReader
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Ограничения на входящие PDF (можно переопределить переменными окружения)
+MAX_PDF_PAGES = int(os.getenv('QR_MAX_PDF_PAGES', '300'))
+MAX_PAGE_INCHES = float(os.getenv('QR_MAX_PAGE_INCHES', '100'))  # A0 - 46.8 дюйма
+# Сканы не отрисовываются с разрешением выше собственного, но и не ниже этого
+MIN_RENDER_DPI = int(os.getenv('QR_MIN_RENDER_DPI', '150'))
+# Содержимое страницы-скана - только размещение изображения, несколько десятков байт
+MAX_SCAN_CONTENT_BYTES = 1024
+
+
+class PdfRejected(ValueError):
+    """PDF нельзя обработать; текст исключения показывается пользователю"""
+
+
+class PdfInfo:
+    """Сведения о PDF, полученные за один разбор файла"""
+
+    def __init__(self, reader, page_sizes, scan_dpis):
+        self.reader = reader
+        self.page_sizes = page_sizes  # (ширина, высота) страниц в дюймах, с учетом /Rotate
+        self.scan_dpis = scan_dpis  # разрешение скана для страниц-изображений, иначе None
+
+    @property
+    def page_count(self):
+        return len(self.page_sizes)
+
+    @property
+    def is_scanned(self):
+        """Все страницы - отсканированные изображения без текста и векторной графики"""
+        return all(scan_dpi is not None for scan_dpi in self.scan_dpis)
+
+    def render_dpi(self, dpi):
+        """
+        Разрешение растровых страниц для этого документа
+
+        Отрисовка скана с разрешением выше исходного только увеличивает страницы,
+        не добавляя деталей, поэтому для сканов dpi ограничивается их разрешением.
+        """
+        if not self.is_scanned:
+            return dpi
+        return max(MIN_RENDER_DPI, min(dpi, round(max(self.scan_dpis))))
+
+
+def _single_image(obj, get_data, depth=2):
+    """
+    Единственное изображение, которое рисует страница или форма (или None)
+
+    Содержимое не должно выводить текст (операторы Tj/TJ); формы с одним изображением внутри
+    (так изображения размещают многие программы) просматриваются на depth уровней.
+    Содержимое (get_data()) распаковывается, только если в ресурсах ровно один
+    XObject: векторные страницы отсеиваются без распаковки.
+    """
+    resources = obj.get('/Resources')
+    if resources is None:
+        return None
+    xobjects = resources.get_object().get('/XObject')
+    if xobjects is None:
+        return None
+    xobjects = xobjects.get_object()
+    if len(xobjects) != 1:
+        return None
+    data = get_data()
+    if len(data) > MAX_SCAN_CONTENT_BYTES or b'Tj' in data or b'TJ' in data:
+        return None
+    child = next(iter(xobjects.values())).get_object()
+    if child.get('/Subtype') == '/Image':
+        return child
+    if child.get('/Subtype') == '/Form' and depth > 1:
+        return _single_image(child, child.get_data, depth - 1)
+    return None
+
+
+def _scan_dpi(page, width, height):
+    """Разрешение страницы, если она состоит из одного изображения без текста"""
+    def get_data():
+        contents = page.get_contents()
+        return contents.get_data() if contents is not None else b''
+
+    image = _single_image(page, get_data)
+    if image is None:
+        return None
+    pixels = max(int(image['/Width']), int(image['/Height']))
+    return pixels / max(width, height)
+
+
+def inspect_pdf(pdf_path):
+    """
+    Читает структуру PDF без отрисовки страниц и проверяет ограничения
+
+    Returns:
+        PdfInfo: Число и размеры страниц, признаки скана. Объект PdfReader
+            сохраняется в info.reader, чтобы не разбирать файл повторно
+
+    Raises:
+        PdfRejected: Файл поврежден, защищен паролем или слишком велик
+    """
+    try:
+        reader = PdfReader(pdf_path)
+        if reader.is_encrypted and not reader.decrypt(''):
+            raise PdfRejected("PDF защищен паролем. Отправьте файл без пароля.")
+        num_pages = len(reader.pages)
+    except PdfRejected:
+        raise
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать PDF {pdf_path}: {str(e)}")
+        raise PdfRejected("Файл PDF поврежден или не может быть прочитан.")
+
+    if num_pages == 0:
+        raise PdfRejected("В PDF нет ни одной страницы.")
+    if num_pages > MAX_PDF_PAGES:
+        raise PdfRejected(f"Слишком много страниц: {num_pages}, допускается не больше {MAX_PDF_PAGES}.")
+
+    page_sizes = []
+    scan_dpis = []
+    for i, page in enumerate(reader.pages, start=1):
+        try:
+            box = page.mediabox
+            width, height = float(box.width) / 72.0, float(box.height) / 72.0
+            rotation = int(page.get('/Rotate', 0) or 0) % 180
+            scan_dpi = _scan_dpi(page, width, height)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать страницу {i} PDF {pdf_path}: {str(e)}")
+            raise PdfRejected(f"Страница {i} PDF повреждена.")
+        if width <= 0 or height <= 0:
+            raise PdfRejected(f"Страница {i} PDF имеет нулевой размер.")
+        if max(width, height) > MAX_PAGE_INCHES:
+            raise PdfRejected(
+                f"Страница {i} слишком большая: {width:.0f}x{height:.0f} дюймов, "
+                f"допускается не больше {MAX_PAGE_INCHES:.0f}."
+            )
+        page_sizes.append((height, width) if rotation == 90 else (width, height))
+        scan_dpis.append(scan_dpi)
+
+    info = PdfInfo(reader, page_sizes, scan_dpis)
+    logger.info(f"PDF {pdf_path}: страниц {info.page_count}, скан: {'да' if info.is_scanned else 'нет'}")
+    return info
@@ -0,0 +1,103 @@
+import os
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from pdf2image import convert_from_path
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Параметры отрисовки (можно переопределить переменными окружения)
+RENDER_WORKERS = int(os.getenv('QR_RENDER_WORKERS', '2'))
+# Страниц в одном вызове pdftoppm. Страницы в полном разрешении пишутся
+# на диск (on_disk=True), иначе в памяти оказались бы RENDER_WORKERS x
+# RENDER_CHUNK_PAGES больших страниц
+RENDER_CHUNK_PAGES = int(os.getenv('QR_RENDER_CHUNK_PAGES', '4'))
+
+
+def _page_chunks(pages, chunk_size):
+    """Разбивает номера страниц на непрерывные диапазоны не длиннее chunk_size"""
+    chunk = []
+    for page in pages:
+        if chunk and (page != chunk[-1] + 1 or len(chunk) == chunk_size):
+            yield chunk
+            chunk = []
+        chunk.append(page)
+    if chunk:
+        yield chunk
+
+
+def iter_pdf_pages(pdf_path, dpi, pages, workers=RENDER_WORKERS, chunk_size=RENDER_CHUNK_PAGES, on_disk=False):
+    """
+    Отрисовывает страницы PDF по мере надобности, сохраняя их порядок
+
+    Каждый вызов pdftoppm разбирает документ один раз и отрисовывает сразу диапазон
+    из chunk_size страниц, а не одну страницу. Одновременно работают не больше
+    workers процессов pdftoppm, и в памяти находятся страницы не больше чем
+    workers диапазонов, сколько бы страниц ни было в документе.
+
+    С on_disk=True pdftoppm пишет диапазоны во временный каталог, а страницы
+    читаются с диска по одной при выдаче: в памяти находится только выданная
+    страница. Так отрисовываются страницы в полном разрешении.
+
+    Args:
+        pdf_path (str): Путь к PDF файлу
+        dpi (int): Разрешение отрисовки
+        pages (iterable): Номера страниц (с 1) в порядке возрастания
+        workers (int): Одновременных процессов pdftoppm
+        chunk_size (int): Страниц в одном вызове pdftoppm
+        on_disk (bool): Держать отрисованные диапазоны на диске, а не в памяти
+
+    Yields:
+        tuple: (номер страницы, PIL.Image). Если pdftoppm не вернул страницу,
+            вместо изображения возвращается None
+    """
+    chunks = _page_chunks(pages, max(1, chunk_size))
+    output_dir = tempfile.TemporaryDirectory(prefix='qr_render_') if on_disk else None
+
+    def render(chunk):
+        if output_dir is None:
+            return chunk, convert_from_path(pdf_path, dpi=dpi, first_page=chunk[0], last_page=chunk[-1])
+        return chunk, convert_from_path(pdf_path, dpi=dpi, first_page=chunk[0], last_page=chunk[-1],
+                                        output_folder=output_dir.name, paths_only=True)
+
+    def load(path):
+        # Страница читается с диска, когда до нее дошла очередь, и файл сразу удаляется
+        with Image.open(path) as image:
+            image.load()
+        os.remove(path)
+        return image
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='pdf_render') as executor:
+            in_flight = deque()
+
+            def submit_next():
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    in_flight.append(executor.submit(render, chunk))
+
+            for _ in range(max(1, workers)):
+                submit_next()
+
+            try:
+                while in_flight:
+                    chunk, images = in_flight.popleft().result()
+                    submit_next()
+                    images += [None] * (len(chunk) - len(images))
+                    for index, page in enumerate(chunk):
+                        # Страница больше не удерживается списком, когда потребитель ее отпустит
+                        image, images[index] = images[index], None
+                        if output_dir is not None and image is not None:
+                            image = load(image)
+                        yield page, image
+                    del images
+            finally:
+                # Потребитель остановился раньше (ошибка на странице) - лишние диапазоны не нужны
+                for future in in_flight:
+                    future.cancel()
+    finally:
+        if output_dir is not None:
+            output_dir.cleanup()
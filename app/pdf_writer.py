@@ -0,0 +1,145 @@
+import os
+import io
+import logging
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Объекты 1 и 2 - каталог и дерево страниц, они пишутся последними
+_CATALOG_ID = 1
+_PAGES_ID = 2
+
+
+class StreamingPdfWriter:
+    """
+    Постраничная запись растрового PDF
+
+    Каждая страница сжимается в JPEG и сразу записывается в файл, после чего
+    изображение больше не нужно. В памяти остаются только смещения объектов
+    для таблицы xref, поэтому расход памяти не зависит от числа страниц.
+
+    Файл пишется рядом с output_path и переименовывается при close(), так что
+    недописанный PDF никогда не оказывается на месте результата. Если выйти
+    из блока with без вызова close(), недописанный файл удаляется.
+
+    Пример:
+        with StreamingPdfWriter(output_path, resolution=300) as writer:
+            for image in pages:
+                writer.add_page(image)
+            writer.close()
+    """
+
+    def __init__(self, output_path, resolution=72.0, quality=75):
+        """
+        Args:
+            output_path (str): Путь к итоговому PDF
+            resolution (float): Разрешение страниц (точек на дюйм) для размера страницы
+            quality (int): Качество JPEG
+        """
+        self.output_path = output_path
+        self.resolution = float(resolution)
+        self.quality = quality
+        self._temp_path = f"{output_path}.part"
+        self._file = open(self._temp_path, 'wb')
+        self._offsets = {}
+        self._page_ids = []
+        self._next_id = _PAGES_ID + 1
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.abort()
+        return False
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    def _write_object(self, obj_id, body, stream=None):
+        self._offsets[obj_id] = self._file.tell()
+        self._file.write(f"{obj_id} 0 obj\n".encode())
+        self._file.write(body)
+        if stream is not None:
+            self._file.write(b"\nstream\n")
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def _reserve_ids(self, count):
+        first = self._next_id
+        self._next_id += count
+        return range(first, first + count)
+
+    def encode_page(self, image):
+        """
+        Сжимает страницу для add_encoded_page
+
+        Не обращается к файлу, поэтому может выполняться в другом потоке,
+        пока в файл записываются предыдущие страницы.
+        """
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        color_space = '/DeviceGray' if image.mode == 'L' else '/DeviceRGB'
+        data = io.BytesIO()
+        image.save(data, format='JPEG', quality=self.quality)
+        return image.size, color_space, data.getvalue()
+
+    def add_page(self, image):
+        """Добавляет страницу из PIL.Image (RGB или оттенки серого)"""
+        self.add_encoded_page(self.encode_page(image))
+
+    def add_encoded_page(self, encoded):
+        """Добавляет страницу, сжатую encode_page"""
+        (width, height), color_space, data = encoded
+
+        image_id, content_id, page_id = self._reserve_ids(3)
+        self._write_object(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode "
+            f"/Length {len(data)} >>"
+        ).encode(), data)
+
+        page_width = width * 72.0 / self.resolution
+        page_height = height * 72.0 / self.resolution
+        content = f"q {page_width:.4f} 0 0 {page_height:.4f} 0 0 cm /Im0 Do Q".encode()
+        self._write_object(content_id, f"<< /Length {len(content)} >>".encode(), content)
+        self._write_object(page_id, (
+            f"<< /Type /Page /Parent {_PAGES_ID} 0 R "
+            f"/MediaBox [0 0 {page_width:.4f} {page_height:.4f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+            f"/Contents {content_id} 0 R >>"
+        ).encode())
+        self._page_ids.append(page_id)
+
+    def close(self):
+        """Дописывает дерево страниц, таблицу xref и переименовывает файл в output_path"""
+        if not self._page_ids:
+            self.abort()
+            raise ValueError("PDF не содержит ни одной страницы")
+
+        kids = ' '.join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(_PAGES_ID, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode())
+        self._write_object(_CATALOG_ID, f"<< /Type /Catalog /Pages {_PAGES_ID} 0 R >>".encode())
+
+        xref_offset = self._file.tell()
+        size = self._next_id
+        self._file.write(f"xref\n0 {size}\n".encode())
+        self._file.write(b"0000000000 65535 f \n")
+        for obj_id in range(1, size):
+            self._file.write(f"{self._offsets[obj_id]:010d} 00000 n \n".encode())
+        self._file.write((
+            f"trailer\n<< /Size {size} /Root {_CATALOG_ID} 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n"
+        ).encode())
+        self._file.close()
+        os.replace(self._temp_path, self.output_path)
+        logger.info(f"PDF записан: {self.output_path}, страниц: {len(self._page_ids)}")
+
+    def abort(self):
+        """Закрывает и удаляет недописанный файл (после close() ничего не делает)"""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
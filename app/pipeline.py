@@ -0,0 +1,168 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Сколько страниц может ждать между соседними стадиями (можно переопределить переменной окружения)
+PIPELINE_QUEUE_SIZE = int(os.getenv('QR_PIPELINE_QUEUE_SIZE', '2'))
+# Сколько пакетная стадия ждет следующих страниц после первой, секунд
+PIPELINE_BATCH_WAIT = float(os.getenv('QR_PIPELINE_BATCH_WAIT', '0.05'))
+
+_DONE = object()
+
+
+class PagePipeline:
+    """
+    Конвейер обработки страниц: каждая стадия работает в своем потоке
+
+    Стадии связаны очередями ограниченного размера, поэтому пока одна страница
+    проходит детекцию, следующая уже отрисовывается, а предыдущая кодируется,
+    и при этом в памяти находится не больше нескольких страниц. У каждой стадии
+    один поток, так что порядок страниц сохраняется.
+
+    Стадия - функция от элемента, возвращающая элемент для следующей стадии.
+    Если она вернула None или выбросила исключение, конвейер останавливается:
+    новые элементы не берутся, а run() завершается без оставшихся результатов
+    (failed становится True).
+
+    Пакетная стадия задается тройкой (имя, функция, размер пакета): функция
+    получает список из не более чем batch_size элементов и возвращает список
+    результатов. Пакет собирается, пока он не заполнится или пока не пройдет
+    batch_wait секунд после первого элемента.
+
+    Пример:
+        pipeline = PagePipeline([('detect', detect), ('encode', encode)])
+        for result in pipeline.run(pages):
+            ...
+        if pipeline.failed:
+            ...
+    """
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, batch_wait=PIPELINE_BATCH_WAIT):
+        """
+        Args:
+            stages (list): Пары (имя стадии, функция) или тройки (имя, функция, размер пакета)
+            queue_size (int): Размер очереди перед каждой стадией
+            batch_wait (float): Максимальное ожидание заполнения пакета, секунд
+        """
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.batch_wait = batch_wait
+        self.failed = False
+        self._stop = threading.Event()
+
+    def _put(self, target, item):
+        """Кладет элемент в очередь, пока конвейер не остановлен"""
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source):
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, name, error=None):
+        if error is not None:
+            logger.error(f"Ошибка на стадии {name}: {str(error)}", exc_info=error)
+        self.failed = True
+        self._stop.set()
+
+    def _feed(self, items, target):
+        try:
+            for item in items:
+                if not self._put(target, item):
+                    return
+        except Exception as e:
+            self._fail('source', e)
+        finally:
+            self._put(target, _DONE)
+
+    def _work(self, name, func, source, target):
+        while True:
+            item = self._get(source)
+            if item is _DONE:
+                break
+            try:
+                result = func(item)
+            except Exception as e:
+                self._fail(name, e)
+                break
+            if result is None:
+                self._fail(name)
+                break
+            if not self._put(target, result):
+                break
+        self._put(target, _DONE)
+
+    def _work_batch(self, name, func, batch_size, source, target):
+        done = False
+        while not done:
+            item = self._get(source)
+            if item is _DONE:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    break
+                try:
+                    item = source.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+            try:
+                results = func(batch)
+            except Exception as e:
+                self._fail(name, e)
+                break
+            if results is None:
+                self._fail(name)
+                break
+            if not all(self._put(target, result) for result in results):
+                break
+        self._put(target, _DONE)
+
+    def run(self, items):
+        """
+        Пропускает items через все стадии и возвращает результаты по порядку
+
+        items перебирается в отдельном потоке. Генератор должен быть доведен
+        до конца или закрыт: при закрытии потоки стадий останавливаются.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]),
+                                    name='pipeline_source', daemon=True)]
+        for index, (name, func, *batch_size) in enumerate(self.stages):
+            if batch_size:
+                target, args = self._work_batch, (name, func, batch_size[0], queues[index], queues[index + 1])
+            else:
+                target, args = self._work, (name, func, queues[index], queues[index + 1])
+            threads.append(threading.Thread(target=target, args=args, name=f"pipeline_{name}", daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
@@ -1,35 +1,66 @@
 import os
+import io
+import json
 import logging
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, TiffImagePlugin
 import qrcode
 from pdf2image import convert_from_path
-from PyPDF2 import PdfReader
-from .yolo_detector import YOLODetector
-import tempfile
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from .model_registry import ModelRegistry, DETECT_MAX_BATCH
+from .pdf_render import iter_pdf_pages
+from .pdf_writer import StreamingPdfWriter
+from .pdf_inspect import inspect_pdf
+from .image_encoder import encode_image, save_options, patch_jpeg
+from .pipeline import PagePipeline
 import shutil
-import gc
+import threading
+from contextlib import contextmanager, closing
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+# Изображения больше этого размера (по длинной стороне) уменьшаются перед
+# детекцией: сеть все равно работает с 640x640, а QR-код вставляется в оригинал
+DETECT_MAX_SIDE = int(os.getenv('QR_DETECT_MAX_SIDE', '2048'))
+# Крупноформатные сканы (A0 при 400 dpi - около 250 Мпикс) больше стандартного
+# ограничения Pillow против "бомб" распаковки
+Image.MAX_IMAGE_PIXELS = int(os.getenv('QR_MAX_IMAGE_PIXELS', str(400 * 1000 * 1000)))
+
 class QrProcessor:
-    def __init__(self):
-        self.detector = None
-        self.loaded = False
+    def __init__(self, registry=None):
+        # Реестр модели позволяет подменять веса без перезапуска бота
+        self.registry = registry or ModelRegistry()
+        # Процессор может использоваться из нескольких потоков пула
+        self._local = threading.local()
 
     def get_detector(self):
-        """Получает или создает экземпляр YOLO детектора"""
-        if not self.loaded:
-            try:
-                self.detector = YOLODetector()
-                logger.info("YOLO детектор успешно инициализирован")
-                self.loaded = True
-            except Exception as e:
-                logger.error(f"Ошибка при инициализации YOLO детектора: {str(e)}", exc_info=True)
-                raise
-        return self.detector
+        """Получает YOLO детектор: закрепленный за текущей задачей или текущий из реестра"""
+        detector = getattr(self._local, 'detector', None)
+        if detector is not None:
+            return detector
+        try:
+            return self.registry.get()
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации YOLO детектора: {str(e)}", exc_info=True)
+            raise
+
+    @contextmanager
+    def pinned_detector(self):
+        """
+        Закрепляет текущую модель за задачей в этом потоке
+
+        Если во время обработки многостраничного документа веса будут заменены,
+        задача все равно доработает на той модели, с которой начала.
+        """
+        self._local.detector = self.get_detector()
+        try:
+            yield self._local.detector
+        finally:
+            self._local.detector = None
 
     def generate_qr_code(self, content, size=150):
         """Генерирует QR-код с заданным содержимым"""
@@ -73,9 +104,11 @@ class QrProcessor:
         mask = cv2.dilate(mask, kernel, iterations=1)
         return mask
 
-    def find_qr_position(self, image_path):
-        """Находит оптимальное место для QR-кода на изображении"""
-        if image_path.lower().endswith('.pdf'):
+    def find_qr_position(self, image_path, qr_size=150):
+        """Находит оптимальное место для QR-кода на изображении (путь или массив BGR)"""
+        if isinstance(image_path, np.ndarray):
+            image = image_path
+        elif image_path.lower().endswith('.pdf'):
             images = convert_from_path(image_path)
             if not images:
                 return None
@@ -87,10 +120,9 @@ class QrProcessor:
                 return None
 
         height, width = image.shape[:2]
-        qr_size = 150  # Уменьшенный размер QR-кода
         mask = self.detect_important_regions(image)
 
-        margin = 50  # отступ от края
+        margin = qr_size // 3  # отступ от края (50 пикселей для QR-кода 150x150)
         positions = [
             (width - qr_size - margin, margin),                    # Правый верхний
             (margin, margin),                                      # Левый верхний
@@ -114,9 +146,162 @@ class QrProcessor:
 
         return best_position
 
-    def add_qr_to_image(self, image_path: str, qr_content: str, output_path: str) -> bool:
+    @staticmethod
+    def _to_bgr(image):
+        """Массив BGR для детектора из PIL.Image (convert('RGB') копирует даже RGB-изображение)"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+    def _find_position(self, image, qr_size=150, detector=None):
+        """Ищет место для QR-кода детектором, а если он не справился - резервным методом"""
+        position = (detector or self.get_detector()).find_empty_space(image, qr_size)
+        if position is None:
+            position = self.find_qr_position(image, qr_size)
+        return position
+
+    @staticmethod
+    def _detection_image(base_img, data=None):
+        """
+        Изображение для детектора: BGR-массив не больше DETECT_MAX_SIDE по длинной стороне
+
+        JPEG по возможности декодируется сразу в уменьшенном виде (draft),
+        остальные форматы уменьшаются после декодирования.
+
+        Returns:
+            tuple: (массив BGR, во сколько раз он меньше base_img)
+        """
+        width, height = base_img.size
+        factor = -(-max(width, height) // DETECT_MAX_SIDE)
+        if factor <= 1:
+            return QrProcessor._to_bgr(base_img), 1
+        small = None
+        if data is not None and base_img.format == 'JPEG':
+            small = Image.open(io.BytesIO(data))
+            small.draft('RGB', (width // factor, height // factor))
+        if small is None or small.size[0] > width // factor * 2:
+            small = QrProcessor._reduce(base_img, factor)
+        return QrProcessor._to_bgr(small), width / small.size[0]
+
+    @staticmethod
+    def _reduce(image, factor):
+        """Уменьшает изображение в factor раз усреднением пикселей"""
+        if image.mode in ('L', 'RGB', 'RGBA', 'CMYK'):
+            return image.reduce(factor)
+        # Двухцветные и палитровые изображения (типичные для сканов TIFF) Pillow
+        # так не уменьшает; переводим их в оттенки серого полосами, чтобы
+        # не держать в памяти полноразмерную копию
+        mode = 'L' if image.mode == '1' else 'RGB'
+        width, height = image.size
+        reduced = Image.new(mode, (-(-width // factor), -(-height // factor)))
+        band = factor * 256
+        for top in range(0, height, band):
+            strip = image.crop((0, top, width, min(height, top + band))).convert(mode)
+            reduced.paste(strip.reduce(factor), (0, top // factor))
+        return reduced
+
+    @staticmethod
+    def _scale_up(position, factor, image_size, qr_size=150):
+        """Переводит позицию с уменьшенного изображения на исходное, не выходя за его границы"""
+        width, height = image_size
+        x = min(max(0, round(position[0] * factor)), max(0, width - qr_size))
+        y = min(max(0, round(position[1] * factor)), max(0, height - qr_size))
+        return (x, y)
+
+    def _locate(self, base_img, data=None):
+        """Ищет место для QR-кода на base_img, для больших изображений - по уменьшенной копии"""
+        image, factor = self._detection_image(base_img, data)
+        if factor == 1:
+            return self._find_position(image)
+        position = self._find_position(image, max(1, round(150 / factor)))
+        return self._scale_up(position, factor, base_img.size) if position is not None else None
+
+    def _locate_batch(self, images):
+        """
+        Ищет места для QR-кода сразу на нескольких изображениях (см. _locate)
+
+        Args:
+            images (list): Пары (PIL.Image, исходный файл в памяти или None)
+
+        Returns:
+            list: Для каждого изображения (x, y) или None
+        """
+        return self._locate_reduced([
+            (*self._detection_image(base_img, data), base_img.size) for base_img, data in images
+        ])
+
+    def _locate_reduced(self, reduced):
+        """
+        То же, что _locate_batch, по уже подготовленным изображениям для детектора
+
+        Args:
+            reduced (list): Тройки (массив BGR из _detection_image, во сколько раз он
+                меньше исходного изображения, размер исходного изображения)
+        """
+        positions = [None] * len(reduced)
+        # Крупные изображения уменьшаются, и размер QR-кода на них меньше;
+        # qr_size у детектора общий на пакет, поэтому пакеты - по размеру
+        batches = {}
+        for index, (_, factor, _) in enumerate(reduced):
+            batches.setdefault(max(1, round(150 / factor)), []).append(index)
+        for qr_size, batch in batches.items():
+            found = self.get_detector().find_empty_spaces([reduced[index][0] for index in batch], qr_size)
+            for index, position in zip(batch, found):
+                image, factor, image_size = reduced[index]
+                if position is None:
+                    position = self.find_qr_position(image, qr_size)
+                if position is not None:
+                    positions[index] = self._scale_up(position, factor, image_size)
+        return positions
+
+    def _place_qr(self, base_img, qr_content: str, position=None, data=None, size=150):
+        """
+        Находит место и вставляет QR-код в base_img (PIL.Image)
+
+        Изображение преобразуется в массив один раз, детектор и резервный
+        метод работают с одним и тем же массивом. Если position уже известна
+        (например, из кэша), поиск места пропускается.
+
+        Args:
+            data (bytes): Исходный файл base_img, если он есть в памяти
+                (JPEG тогда декодируется для детекции в уменьшенном виде)
+            size (int): Сторона QR-кода в пикселях (место ищется только для 150)
+
+        Returns:
+            tuple: (x, y) вставленного QR-кода или None
+        """
+        width, height = base_img.size
+
+        qr_img = self.generate_qr_code(qr_content).resize((size, size))
+
+        white_bg = Image.new('RGB', (size, size), 'white')
+
+        if position is None:
+            position = self._locate(base_img, data)
+        if position is None:
+            logger.warning("Не найдено подходящих мест для QR-кода")
+            return None
+
+        x, y = position
+
+        if x < 0 or y < 0 or x + size > width or y + size > height:
+            logger.warning("QR-код вышел за границы изображения")
+            return None
+
+        base_img.paste(white_bg, (x, y))
+        base_img.paste(qr_img, (x, y))
+        return (x, y)
+
+    def add_qr_to_image(self, image_path: str, qr_content: str, output_path: str,
+                        placements: dict = None, page: int = 1) -> bool:
         """
         Добавляет QR-код на изображение, используя YOLOv5 для определения места размещения
+
+        Args:
+            placements (dict): Позиции QR-кода по номерам страниц. Если для page
+                позиция уже есть, детекция пропускается, иначе найденная позиция
+                записывается в словарь
+            page (int): Номер страницы для placements
         """
         try:
             if image_path.lower().endswith('.pdf'):
@@ -128,77 +313,458 @@ class QrProcessor:
             else:
                 base_img = Image.open(image_path)
 
-            width, height = base_img.size
+            position = self._place_qr(base_img, qr_content, placements.get(page) if placements else None)
+            if position is None:
+                return False
+            if placements is not None:
+                placements[page] = position
+
+            output_format = Image.registered_extensions().get(os.path.splitext(output_path)[1].lower())
+            base_img.save(output_path, format=output_format, **save_options(base_img, output_format))
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении QR-кода: {str(e)}", exc_info=True)
+            return False
 
-            qr_img = self.generate_qr_code(qr_content).resize((150, 150))
+    def add_qr_to_buffer(self, data: bytes, qr_content: str, placements: dict = None, page: int = 1):
+        """
+        Добавляет QR-код на изображение, полностью находящееся в памяти
 
-            white_bg = Image.new('RGB', (150, 150), 'white')
+        Args:
+            data (bytes): Содержимое файла изображения (JPG, PNG, TIFF)
+            qr_content (str): Содержимое QR-кода
+            placements (dict): Позиции QR-кода по номерам страниц (см. add_qr_to_image)
+            page (int): Номер страницы для placements
 
-            detector = self.get_detector()
-            position = detector.find_empty_space(image_path)
+        Returns:
+            bytes: Изображение с QR-кодом в исходном формате или None в случае ошибки
+        """
+        try:
+            base_img = Image.open(io.BytesIO(data))
+            image_format = base_img.format
+            if image_format == 'TIFF' and getattr(base_img, 'n_frames', 1) > 1:
+                return self._add_qr_to_frames(base_img, qr_content, placements)
+            if image_format == 'MPO':
+                # JPEG с дополнительными кадрами (HDR-снимки телефонов): QR-код
+                # ставится на основное изображение, результат - обычный JPEG
+                image_format = 'JPEG'
+
+            position = placements.get(page) if placements else None
             if position is None:
-                position = self.find_qr_position(image_path)
+                # Место ищется один раз, и для замены блоков JPEG, и для вставки
+                position = self._locate(base_img, data)
             if position is None:
-                logger.warning("Не найдено подходящих мест для QR-кода")
-                return False
+                logger.error("Не найдено подходящих мест для QR-кода")
+                return None
+            if image_format == 'JPEG':
+                # JPEG по возможности не пересжимается: заменяются только блоки под QR-кодом
+                patched = self._patch_jpeg(data, qr_content, position)
+                if patched is not None:
+                    if placements is not None:
+                        placements[page] = position
+                    return patched
+
+            position = self._place_qr(base_img, qr_content, position, data)
+            if position is None:
+                return None
+            if placements is not None:
+                placements[page] = position
 
-            x, y = position
+            return encode_image(base_img, image_format)
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении QR-кода: {str(e)}", exc_info=True)
+            return None
 
-            if x < 0 or y < 0 or x + 150 > width or y + 150 > height:
-                logger.warning("QR-код вышел за границы изображения")
-                return False
+    def _patch_jpeg(self, data, qr_content, position):
+        """Вставляет QR-код в JPEG заменой блоков MCU (None, если так сделать нельзя)"""
+        if position is None:
+            return None
+        return patch_jpeg(data, self.generate_qr_code(qr_content).resize((150, 150)), position)
 
-            base_img.paste(white_bg, (x, y))
-            base_img.paste(qr_img, (x, y))
+    def _add_qr_to_frames(self, base_img, qr_content, placements=None):
+        """
+        Добавляет QR-код на каждую страницу многостраничного TIFF
 
-            base_img.save(output_path)
-            return True
+        Страницы декодируются по одной: для детекции хранятся только их
+        уменьшенные копии, а результат дописывается в TIFF постранично.
+
+        Returns:
+            bytes: Многостраничный TIFF с QR-кодами или None в случае ошибки
+        """
+        num_frames = base_img.n_frames
+        placements = {} if placements is None else placements
+
+        # Места на страницах без известной позиции ищутся пакетной детекцией
+        pending = [i for i in range(1, num_frames + 1) if i not in placements]
+        for start in range(0, len(pending), DETECT_MAX_BATCH):
+            batch = pending[start:start + DETECT_MAX_BATCH]
+            reduced = []
+            for i in batch:
+                base_img.seek(i - 1)
+                reduced.append((*self._detection_image(base_img), base_img.size))
+            for i, position in zip(batch, self._locate_reduced(reduced)):
+                if position is not None:
+                    placements[i] = position
+
+        output = io.BytesIO()
+        with TiffImagePlugin.AppendingTiffWriter(output, True) as tiff:
+            for i in range(1, num_frames + 1):
+                logger.info(f"Обработка страницы {i} из {num_frames}")
+                if i not in placements:
+                    logger.error(f"Не найдено места для QR-кода на странице {i}")
+                    return None
+                base_img.seek(i - 1)
+                frame = base_img.copy()
+                page_qr_content = qr_content + f"\nСтраница: {i} из {num_frames}"
+                if self._place_qr(frame, page_qr_content, placements[i]) is None:
+                    logger.error(f"Не удалось добавить QR-код на страницу {i}")
+                    return None
+                # Сжатие и разрешение у страниц могут быть разными
+                frame.save(tiff, format='TIFF', **save_options(base_img, 'TIFF'))
+                tiff.newFrame()
+                frame.close()
+        return output.getvalue()
+
+    def add_qr_to_buffers(self, items, placements: dict = None):
+        """
+        Добавляет QR-коды на несколько изображений (альбом) с одной пакетной детекцией
+
+        Args:
+            items (list): Пары (содержимое файла, содержимое QR-кода)
+            placements (dict): Позиции QR-кода по номерам изображений (с 1), см. add_qr_to_image
+
+        Returns:
+            list[bytes]: Изображения с QR-кодами или None, если хотя бы одно не удалось обработать
+        """
+        try:
+            placements = {} if placements is None else placements
+            base_images = [Image.open(io.BytesIO(data)) for data, _ in items]
+
+            # Детекция выполняется одним пакетом для всех изображений без известной позиции
+            pending = [i for i in range(1, len(items) + 1) if i not in placements]
+            positions = self._locate_batch([(base_images[page - 1], items[page - 1][0]) for page in pending])
+            for page, position in zip(pending, positions):
+                if position is not None:
+                    placements[page] = position
+
+            results = []
+            for page, (base_img, (_, qr_content)) in enumerate(zip(base_images, items), start=1):
+                if page not in placements:
+                    logger.error(f"Не найдено места для QR-кода на изображении {page}")
+                    return None
+                image_format = base_img.format
+                patched = self._patch_jpeg(items[page - 1][0], qr_content, placements[page]) \
+                    if image_format == 'JPEG' else None
+                if patched is not None:
+                    results.append(patched)
+                    continue
+                if self._place_qr(base_img, qr_content, placements[page]) is None:
+                    return None
+                results.append(encode_image(base_img, image_format))
+            return results
         except Exception as e:
-            logger.error(f"Ошибка при добавлении QR-кода: {str(e)}", exc_info=True)
-            return False
+            logger.error(f"Ошибка при добавлении QR-кодов на альбом: {str(e)}", exc_info=True)
+            return None
 
-    def process_pdf(self, pdf_path: str, qr_content_template: str, output_path: str, dpi: int = 300) -> bool:
+    def process_pdf(self, pdf_path: str, qr_content_template: str, output_path: str, dpi: int = 300,
+                    work_dir: str = None, on_progress=None, placements: dict = None,
+                    output_mode: str = 'raster', detect_dpi: int = 100, layouts=None, info=None,
+                    qr_dpi: int = None) -> bool:
         """
         Обрабатывает PDF файл, добавляя QR-код на каждую страницу
+
+        Args:
+            dpi (int): Разрешение растровых страниц. Размер QR-кода - 150 пикселей
+                при этом разрешении, в режиме vector сохраняется тот же физический размер
+            work_dir (str): Каталог для позиций QR-кода. Если задан, после сбоя
+                детекция для уже обработанных страниц не повторяется
+            on_progress: Функция on_progress(stage, page, num_pages), где stage -
+                'rasterizing', 'placing' или 'assembling'
+            placements (dict): Позиции QR-кода по номерам страниц в пикселях
+                отрисовки с разрешением detect_dpi: известные позиции используются
+                без детекции, новые записываются в словарь
+            output_mode (str): 'raster' - страницы пересобираются из изображений,
+                'vector' - исходное содержимое страниц сохраняется, а QR-код
+                добавляется поверх небольшим изображением
+            detect_dpi (int): Разрешение отрисовки страниц для детектора. Детектор
+                все равно уменьшает изображение до 640x640, поэтому место ищется
+                на дешевой отрисовке, а в полном разрешении dpi страница
+                отрисовывается только для растрового результата
+            layouts (PageLayouts): Компоновки страниц: для страниц, похожих
+                на уже обработанные, место берется без детекции
+            info (PdfInfo): Результат inspect_pdf, если файл уже разобран
+            qr_dpi (int): Разрешение, при котором QR-код занимает 150 пикселей
+                (по умолчанию dpi). Скан, отрисованный с меньшим dpi, получает
+                QR-код меньше 150 пикселей того же физического размера
         """
+        def report(stage, page, num_pages):
+            if on_progress is not None:
+                on_progress(stage, page, num_pages)
+
+        qr_dpi = qr_dpi or dpi
+        if output_mode == 'vector':
+            # Страницы не отрисовываются в dpi, от него зависит только размер QR-кода
+            return self._process_pdf_vector(pdf_path, qr_content_template, output_path, qr_dpi, detect_dpi,
+                                            work_dir, report, placements, layouts, info)
+
         try:
             logger.info(f"Начинаем обработку PDF файла: {pdf_path}")
-            num_pages = len(PdfReader(pdf_path).pages)
+            info = info or inspect_pdf(pdf_path)
+            num_pages = info.page_count
             logger.info(f"Всего страниц: {num_pages}")
 
-            with tempfile.TemporaryDirectory(prefix="qr_pdf_") as temp_dir:
-                processed_images = []
+            qr_size = self._detect_qr_size(qr_dpi, detect_dpi)
+            qr_pixels = max(1, round(150 * dpi / qr_dpi))
+            placements = {} if placements is None else placements
+
+            checkpoint_path = os.path.join(work_dir, 'positions.json') if work_dir else None
+            self._load_positions(checkpoint_path, placements)
+            detect_pages = [i for i in range(1, num_pages + 1) if i not in placements]
+            # placements дополняется потоком детекции, поэтому страницы для отрисовки фиксируются заранее
+            detect_set = set(detect_pages)
 
+            # Задача может выполняться в пуле потоков с закрепленной моделью,
+            # а детекция идет в потоке конвейера - передаем ему ту же модель
+            detector = self.get_detector()
+
+            def source_pages():
                 for i in range(1, num_pages + 1):
                     logger.info(f"Обработка страницы {i} из {num_pages}")
-                    images = convert_from_path(pdf_path, dpi=dpi, first_page=i, last_page=i)
-                    if not images:
-                        logger.error(f"Не удалось конвертировать страницу {i}")
-                        return False
-                    img = images[0]
+                    detect_img = next(detect_rendered)[1] if i in detect_set else None
+                    yield {'page': i, 'detect_image': detect_img}
+
+            def detect(tasks):
+                # Страницы приходят пакетами: детектор обрабатывает их за один проход сети
+                pending = [task for task in tasks if task['page'] in detect_set]
+                if pending:
+                    # Прогресс сообщается только по готовым страницам (см. ниже)
+                    self._detect_placements([task['page'] for task in pending],
+                                            [task.pop('detect_image') for task in pending], num_pages, qr_size,
+                                            placements, checkpoint_path, lambda *args: None, detector, layouts)
+                for task in tasks:
+                    task['position'] = placements.get(task['page'])
+                    if task['position'] is None:
+                        return None
+                return tasks
+
+            def render(task):
+                # Полная отрисовка берется, когда место на странице уже известно, по одной странице
+                _, img = next(rendered)
+                if img is None:
+                    logger.error(f"Не удалось конвертировать страницу {task['page']}")
+                    return None
+                task['image'] = img
+                return task
+
+            def composite(task):
+                # QR-код вставляется прямо в отрисованную страницу, без промежуточных файлов
+                i = task['page']
+                img = task['image']
+                page_qr_content = qr_content_template + f"\nСтраница: {i} из {num_pages}"
+                output_position = self._scale_position(task['position'], detect_dpi, dpi, img.size, qr_pixels)
+                if self._place_qr(img, page_qr_content, output_position, size=qr_pixels) is None:
+                    logger.error(f"Не удалось добавить QR-код на страницу {i}")
+                    return None
+                return task
+
+            def encode(task):
+                task['encoded'] = writer.encode_page(task.pop('image'))
+                return task
+
+            # Отрисовка, детекция, вставка QR-кода и сжатие разных страниц идут
+            # одновременно; страницы добавляются в PDF по мере готовности.
+            # Пакетами по DETECT_MAX_BATCH идут только дешевые отрисовки для детектора
+            pipeline = PagePipeline([('detect', detect, DETECT_MAX_BATCH), ('render', render),
+                                     ('composite', composite), ('encode', encode)])
+            with StreamingPdfWriter(output_path, resolution=dpi) as writer, \
+                    closing(iter_pdf_pages(pdf_path, detect_dpi, detect_pages)) as detect_rendered, \
+                    closing(iter_pdf_pages(pdf_path, dpi, range(1, num_pages + 1), on_disk=True)) as rendered:
+                with closing(pipeline.run(source_pages())) as results:
+                    for task in results:
+                        writer.add_encoded_page(task['encoded'])
+                        # Стадии конвейера работают с разными страницами одновременно, поэтому
+                        # прогресс сообщается отсюда, по порядку: страница task['page'] готова
+                        report('placing', task['page'] + 1, num_pages)
+                if pipeline.failed:
+                    return False
 
-                    temp_img_path = os.path.join(temp_dir, f"temp_page_{i}.png")
-                    img.save(temp_img_path, "PNG")
+                report('assembling', num_pages, num_pages)
+                writer.close()
 
-                    page_qr_content = qr_content_template + f"\nСтраница: {i} из {num_pages}"
-                    processed_img_path = os.path.join(temp_dir, f"processed_page_{i}.png")
+            logger.info(f"PDF успешно обработан и сохранен: {output_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при обработке PDF: {str(e)}", exc_info=True)
+            return False
+
+    @staticmethod
+    def _detect_qr_size(dpi, detect_dpi):
+        """Размер QR-кода в пикселях отрисовки для детектора (150 пикселей при разрешении dpi)"""
+        return max(1, round(150 * detect_dpi / dpi))
+
+    @staticmethod
+    def _scale_position(position, detect_dpi, dpi, image_size, qr_size=150):
+        """Переводит позицию из пикселей отрисовки для детектора в пиксели страницы с разрешением dpi"""
+        width, height = image_size
+        scale = dpi / detect_dpi
+        x = min(max(0, round(position[0] * scale)), max(0, width - qr_size))
+        y = min(max(0, round(position[1] * scale)), max(0, height - qr_size))
+        return (x, y)
+
+    @staticmethod
+    def _load_positions(checkpoint_path, placements):
+        """Дополняет placements позициями, сохраненными в work_dir до сбоя"""
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                for page, pos in json.load(f).items():
+                    placements.setdefault(int(page), tuple(pos))
+
+    def _detect_placements(self, pages, rendered_pages, num_pages, qr_size, placements, checkpoint_path, report,
+                           detector=None, layouts=None):
+        """
+        Ищет места для QR-кода на страницах pages по их отрисовкам для детектора
+
+        Страницы, похожие на уже обработанные (layouts), пропускают детекцию,
+        остальные проходят через детектор одним пакетом.
+
+        Позиции (в пикселях отрисовки) сохраняются в placements и в файл checkpoint_path.
+
+        Returns:
+            list: Для каждой страницы (x, y) или None, если ее не удалось отрисовать или место не найдено
+        """
+        positions = [None] * len(pages)
+        images = []
+        fingerprints = {}
+        pending = []
+        for index, (i, rendered_page) in enumerate(zip(pages, rendered_pages)):
+            if rendered_page is None:
+                logger.error(f"Не удалось конвертировать страницу {i}")
+                images.append(None)
+                continue
+            image = self._to_bgr(rendered_page)
+            images.append(image)
+            report('placing', i, num_pages)
+            fingerprint, position = layouts.find(image, qr_size) if layouts is not None else (None, None)
+            if position is None:
+                fingerprints[index] = fingerprint
+                pending.append(index)
+            else:
+                positions[index] = position
+
+        if pending:
+            found = (detector or self.get_detector()).find_empty_spaces([images[index] for index in pending], qr_size)
+            for index, position in zip(pending, found):
+                if position is None:
+                    position = self.find_qr_position(images[index], qr_size)
+                if position is None:
+                    logger.error(f"Не удалось найти место для QR-кода на странице {pages[index]}")
+                    continue
+                if layouts is not None:
+                    layouts.add(fingerprints[index], images[index], position)
+                positions[index] = position
+
+        for i, position in zip(pages, positions):
+            if position is not None:
+                placements[i] = position
+        if checkpoint_path:
+            os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+            with open(checkpoint_path, 'w', encoding='utf-8') as f:
+                json.dump({str(p): list(pos) for p, pos in placements.items()}, f)
+        return positions
+
+    @staticmethod
+    def _pixel_box_to_pdf(page, x, y, size_px, dpi):
+        """
+        Переводит квадрат QR-кода из пикселей отрисованной страницы в координаты PDF
 
-                    ok = self.add_qr_to_image(temp_img_path, page_qr_content, processed_img_path)
-                    if not ok:
-                        logger.error(f"Не удалось добавить QR-код на страницу {i}")
-                        return False
+        pdftoppm отрисовывает MediaBox с учетом /Rotate, поэтому поворот страницы
+        тоже учитывается (сам QR-код читается при любом повороте).
 
-                    processed_images.append(processed_img_path)
+        Returns:
+            tuple: (x0, y0, size) - левый нижний угол и сторона квадрата в пунктах
+        """
+        scale = 72.0 / dpi
+        u, v, size = x * scale, y * scale, size_px * scale
+        box = page.mediabox
+        left, bottom, right, top = float(box.left), float(box.bottom), float(box.right), float(box.top)
+        rotation = int(getattr(page, 'rotation', page.get('/Rotate', 0)) or 0) % 360
+        if rotation == 90:
+            return left + v, bottom + u, size
+        if rotation == 180:
+            return right - u - size, bottom + v, size
+        if rotation == 270:
+            return right - v - size, top - u - size, size
+        return left + u, top - v - size, size
+
+    def _qr_overlay(self, qr_content, x0, y0, size, page_width, page_height):
+        """Одностраничный PDF с QR-кодом на белом фоне в заданном месте"""
+        buffer = io.BytesIO()
+        c = canvas.Canvas(buffer, pagesize=(page_width, page_height))
+        c.setFillColorRGB(1, 1, 1)
+        c.rect(x0, y0, size, size, stroke=0, fill=1)
+        # QR-код вставляется в исходном разрешении модулей, масштабирует его просмотрщик
+        qr_img = self.generate_qr_code(qr_content).convert('L')
+        c.drawImage(ImageReader(qr_img), x0, y0, width=size, height=size)
+        c.showPage()
+        c.save()
+        buffer.seek(0)
+        return PdfReader(buffer).pages[0]
+
+    def _process_pdf_vector(self, pdf_path, qr_content_template, output_path, dpi, detect_dpi,
+                            work_dir, report, placements, layouts=None, info=None):
+        """
+        Добавляет QR-коды поверх исходных страниц PDF без их растеризации
+
+        Страницы отрисовываются только для детектора, с низким разрешением detect_dpi.
+        Найденные позиции сохраняются в work_dir, поэтому после сбоя детекция
+        для уже обработанных страниц не повторяется.
+        """
+        try:
+            logger.info(f"Начинаем обработку PDF файла (с сохранением векторного содержимого): {pdf_path}")
+            info = info or inspect_pdf(pdf_path)
+            reader = info.reader
+            num_pages = info.page_count
+            logger.info(f"Всего страниц: {num_pages}")
 
-                    del img, temp_img_path, processed_img_path
-                    gc.collect()
+            placements = {} if placements is None else placements
+            checkpoint_path = os.path.join(work_dir, 'positions.json') if work_dir else None
+            self._load_positions(checkpoint_path, placements)
 
-                logger.info("Собираем обработанные страницы обратно в PDF...")
-                images = [Image.open(p).convert('RGB') for p in processed_images]
-                images[0].save(output_path, save_all=True, append_images=images[1:])
+            # Тот же физический размер QR-кода, что и при растровой обработке
+            qr_size = self._detect_qr_size(dpi, detect_dpi)
+            writer = PdfWriter()
+            pending = [i for i in range(1, num_pages + 1) if i not in placements]
 
-                logger.info(f"PDF успешно обработан и сохранен: {output_path}")
-                return True
+            with closing(iter_pdf_pages(pdf_path, detect_dpi, pending)) as rendered:
+                for i, page in enumerate(reader.pages, start=1):
+                    logger.info(f"Обработка страницы {i} из {num_pages}")
+                    if i not in placements:
+                        # Детекция идет пакетами по DETECT_MAX_BATCH страниц, которым нужна детекция
+                        batch, pending = pending[:DETECT_MAX_BATCH], pending[DETECT_MAX_BATCH:]
+                        rendered_pages = []
+                        for page_number in batch:
+                            report('rasterizing', page_number, num_pages)
+                            rendered_pages.append(next(rendered)[1])
+                        positions = self._detect_placements(batch, rendered_pages, num_pages, qr_size, placements,
+                                                            checkpoint_path, report, layouts=layouts)
+                        del rendered_pages
+                        if any(position is None for position in positions):
+                            return False
+                    position = placements[i]
+
+                    x0, y0, size = self._pixel_box_to_pdf(page, position[0], position[1], qr_size, detect_dpi)
+                    page_qr_content = qr_content_template + f"\nСтраница: {i} из {num_pages}"
+                    page.merge_page(self._qr_overlay(
+                        page_qr_content, x0, y0, size, float(page.mediabox.right), float(page.mediabox.top)
+                    ))
+                    writer.add_page(page)
+
+            report('assembling', num_pages, num_pages)
+            with open(output_path, 'wb') as f:
+                writer.write(f)
+
+            logger.info(f"PDF успешно обработан и сохранен: {output_path}")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при обработке PDF: {str(e)}", exc_info=True)
-            return False
\ No newline at end of file
+            return False
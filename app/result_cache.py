@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Параметры кэша (можно переопределить переменными окружения)
+CACHE_DIR = os.getenv('QR_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache'))
+CACHE_MAX_BYTES = int(os.getenv('QR_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+
+def file_sha256(path=None, data=None, chunk_size=1024 * 1024):
+    """SHA-256 содержимого файла (по пути или уже загруженного в память)"""
+    digest = hashlib.sha256()
+    if data is not None:
+        digest.update(data)
+    else:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Кэш результатов размещения по содержимому файла
+
+    Ключ - SHA-256 загруженного файла, DPI и хэш весов модели. Значение - выбранные
+    позиции QR-кода для каждой страницы. Готовый документ не хранится: QR-код
+    содержит ID документа и дату, поэтому при повторной загрузке его все равно
+    нужно сгенерировать заново, но детекцию можно пропустить.
+
+    Записи хранятся в отдельных файлах, поэтому кэш можно использовать из нескольких
+    процессов. При превышении max_bytes удаляются записи, которые дольше всего
+    не использовались.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_hash, dpi, weights_hash, preprocess_version=''):
+        return hashlib.sha256(f"{file_hash}:{dpi}:{weights_hash}:{preprocess_version}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # Время изменения используется как время последнего обращения
+            os.utime(path, None)
+            return entry
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Поврежденная запись кэша {path}: {e}")
+            return None
+
+    def _write(self, key, entry):
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def get(self, key):
+        """
+        Возвращает сохраненные позиции {номер страницы: (x, y)} или None
+        """
+        entry = self._read(key)
+        if entry is None or 'positions' not in entry:
+            return None
+        logger.info(f"Найдены сохраненные позиции QR-кода для {len(entry['positions'])} стр.")
+        return {int(page): tuple(pos) for page, pos in entry['positions'].items()}
+
+    def put(self, key, positions):
+        """Сохраняет позиции QR-кода по страницам"""
+        self._write(key, {'positions': {str(page): list(pos) for page, pos in positions.items()}})
+
+    def get_layouts(self, key):
+        """Возвращает компоновки страниц (см. PageLayouts) или None"""
+        entry = self._read(key)
+        return entry.get('layouts') if entry is not None else None
+
+    def put_layouts(self, key, layouts):
+        """Сохраняет компоновки страниц"""
+        self._write(key, {'layouts': layouts})
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока кэш больше max_bytes"""
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith('.json'):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            removed = 0
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            logger.info(f"Из кэша удалено записей: {removed}")
@@ -0,0 +1,397 @@
+import os
+import time
+import asyncio
+import logging
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .qr_processor import QrProcessor
+from .model_registry import ModelRegistry, INFERENCE_BATCHING
+from . import jobs
+from .result_cache import ResultCache, file_sha256
+from .page_layouts import PageLayouts
+from .pdf_inspect import inspect_pdf, PdfRejected
+from .models import JOB_KIND_ALBUM, JOB_RASTERIZING, JOB_PLACING, JOB_ASSEMBLING, JOB_READY, JOB_DELIVERING, JOB_SENT, JOB_FAILED
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Параметры пула обработчиков (можно переопределить переменными окружения)
+WORKER_MODE = os.getenv('QR_WORKER_MODE', 'thread')  # 'thread' или 'process'
+WORKER_COUNT = int(os.getenv('QR_WORKER_COUNT', '2'))
+QUEUE_SIZE = int(os.getenv('QR_QUEUE_SIZE', '20'))
+PER_USER_LIMIT = int(os.getenv('QR_PER_USER_LIMIT', '1'))
+PDF_DPI = int(os.getenv('QR_PDF_DPI', '300'))
+# 'vector' сохраняет исходное содержимое страниц PDF, 'raster' пересобирает их из изображений
+PDF_OUTPUT_MODE = os.getenv('QR_PDF_OUTPUT_MODE', 'vector')
+# Разрешение отрисовки страниц PDF для поиска места QR-кода (в обоих режимах)
+DETECT_DPI = int(os.getenv('QR_DETECT_DPI', '100'))
+PROGRESS_UPDATE_INTERVAL = float(os.getenv('QR_PROGRESS_UPDATE_INTERVAL', '1.0'))
+
+# Один процессор на процесс: в режиме потоков он общий, в режиме процессов
+# каждый дочерний процесс создает свой экземпляр с собственной моделью
+_processor = None
+_processor_lock = threading.Lock()
+# Выполняет ли процесс несколько задач одновременно (пул потоков бота)
+_concurrent_jobs = False
+_result_cache = None
+
+
+def get_processor():
+    """Возвращает экземпляр QrProcessor текущего процесса"""
+    global _processor
+    with _processor_lock:
+        if _processor is None:
+            # Микропакеты объединяют запросы разных задач, поэтому сервер нужен,
+            # только когда задачи процесса выполняются одновременно
+            registry = ModelRegistry(batching=INFERENCE_BATCHING and _concurrent_jobs)
+            _processor = QrProcessor(registry)
+            # Новые веса подхватываются в каждом процессе без перезапуска
+            _processor.registry.start_watching()
+        return _processor
+
+
+def get_result_cache():
+    """Возвращает кэш позиций QR-кода (общий для всех процессов через файлы)"""
+    global _result_cache
+    with _processor_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
+
+
+def run_job(job_id, data=None, return_result=False, info=None):
+    """
+    Выполняет задачу обработки внутри пула (функция должна быть доступна для pickle)
+
+    Ход работы сохраняется в БД, поэтому после перезапуска задача продолжается
+    с последней обработанной страницы.
+
+    Args:
+        job_id (int): ID задачи
+        data: Содержимое изображения (bytes), уже загруженное в память, а для альбома -
+            список пар (имя файла, bytes). Если не задано, исходные файлы задачи читаются один раз
+        return_result (bool): Вернуть готовое изображение вместо записи в output_path.
+            Задача при этом остается в состоянии placing до отправки результата
+        info (PdfInfo): Результат inspect_pdf, если бот уже разобрал PDF (пул потоков)
+
+    Returns:
+        tuple: (итоговое состояние задачи, результат или None). Результат - bytes
+            изображения или, для альбома, список пар (имя файла, bytes)
+    """
+    job = jobs.load_job(job_id)
+    if job is None:
+        logger.error(f"Задача {job_id} не найдена")
+        return JOB_FAILED, None
+    if job.state in (JOB_READY, JOB_DELIVERING, JOB_SENT, JOB_FAILED):
+        return job.state, None
+
+    processor = get_processor()
+    with processor.pinned_detector():
+        return _run_job(job_id, job, processor, data, return_result, info)
+
+
+def _run_job(job_id, job, processor, data, return_result, info=None):
+    """Тело run_job: выполняется с моделью, закрепленной за задачей"""
+    stages = (JOB_RASTERIZING, JOB_PLACING, JOB_ASSEMBLING)
+    progress = {'stage': 0, 'pages_done': 0, 'updated': 0.0}
+    progress_lock = threading.Lock()
+
+    def on_progress(stage, page, num_pages):
+        # Стадии конвейера сообщают о разных страницах из разных потоков, поэтому
+        # стадия и число готовых страниц только растут: прогресс не идет назад
+        with progress_lock:
+            progress['stage'] = max(progress['stage'], stages.index(stage))
+            progress['pages_done'] = max(progress['pages_done'],
+                                         num_pages if stage == JOB_ASSEMBLING else page - 1)
+            # Запись в БД не чаще PROGRESS_UPDATE_INTERVAL: бот все равно показывает
+            # прогресс раз в несколько секунд, а возобновление опирается на файл позиций
+            now = time.monotonic()
+            if stage != JOB_ASSEMBLING and now - progress['updated'] < PROGRESS_UPDATE_INTERVAL:
+                return
+            progress['updated'] = now
+            jobs.update_job(job_id, state=stages[progress['stage']], pages_done=progress['pages_done'],
+                            pages_total=num_pages)
+
+    is_album = job.kind == JOB_KIND_ALBUM
+    is_pdf = not is_album and job.file_name.lower().endswith('.pdf')
+    if is_album and data is None:
+        data = []
+        for name in jobs.album_files(job.source_path):
+            with open(os.path.join(job.source_path, name), 'rb') as source_file:
+                data.append((name, source_file.read()))
+    elif not is_pdf and data is None:
+        with open(job.source_path, 'rb') as source_file:
+            data = source_file.read()
+
+    # Структура PDF читается один раз: до отрисовки отклоняются поврежденные
+    # и слишком большие файлы, а для сканов выбирается разрешение отрисовки
+    pdf_dpi, detect_dpi = PDF_DPI, DETECT_DPI
+    if is_pdf:
+        try:
+            info = info or inspect_pdf(job.source_path)
+        except PdfRejected as e:
+            jobs.update_job(job_id, state=JOB_FAILED, error=str(e))
+            return JOB_FAILED, None
+        # Меньшее разрешение сканов экономит только растровую отрисовку; размер
+        # QR-кода задается для PDF_DPI, поэтому физически он не меняется
+        if PDF_OUTPUT_MODE == 'raster':
+            pdf_dpi = info.render_dpi(PDF_DPI)
+        detect_dpi = min(DETECT_DPI, pdf_dpi)
+
+    # Повторно загруженный файл: позиции QR-кода берутся из кэша без детекции
+    if is_album:
+        file_hash = file_sha256(data=''.join(file_sha256(data=content) for _, content in data).encode())
+    else:
+        file_hash = file_sha256(path=job.source_path, data=data)
+    cache = get_result_cache()
+    # Позиции зависят от разрешения, в котором их искали
+    resolution = f"{PDF_OUTPUT_MODE}:{detect_dpi}:{pdf_dpi}" if is_pdf else 0
+    detector = processor.get_detector()
+    cache_key = cache.make_key(file_hash, resolution, detector.weights_hash, detector.preprocess_version)
+    placements = cache.get(cache_key) or {}
+    cached_placements = dict(placements)
+
+    result = None
+    if is_pdf:
+        logger.info(f"Задача {job_id}: обработка PDF файла {job.file_name}")
+        # Похожие страницы (общая рамка чертежа) используют уже найденные места,
+        # в том числе из предыдущих задач
+        layouts = PageLayouts(cache, cache.make_key('layouts', f"{detect_dpi}:{pdf_dpi}",
+                                                    detector.weights_hash, detector.preprocess_version))
+        success = processor.process_pdf(
+            job.source_path, job.qr_content, job.output_path, dpi=pdf_dpi,
+            work_dir=os.path.join(job.work_dir, 'pages'), on_progress=on_progress,
+            placements=placements, output_mode=PDF_OUTPUT_MODE, detect_dpi=detect_dpi, layouts=layouts,
+            info=info, qr_dpi=PDF_DPI
+        )
+        layouts.log_stats()
+        if success:
+            layouts.save()
+    elif is_album:
+        logger.info(f"Задача {job_id}: обработка альбома из {len(data)} изображений")
+        jobs.update_job(job_id, state=JOB_PLACING, pages_total=len(data))
+        items = [
+            (content, job.qr_content + f"\nФайл: {name.split('_', 1)[1]}\nСтраница: {i} из {len(data)}")
+            for i, (name, content) in enumerate(data, start=1)
+        ]
+        images = processor.add_qr_to_buffers(items, placements=placements)
+        success = images is not None
+        if success:
+            result = [(name, image) for (name, _), image in zip(data, images)]
+            if not return_result:
+                os.makedirs(job.output_path, exist_ok=True)
+                for name, image in result:
+                    with open(os.path.join(job.output_path, name), 'wb') as output_file:
+                        output_file.write(image)
+                result = None
+    else:
+        logger.info(f"Задача {job_id}: обработка изображения {job.file_name}")
+        jobs.update_job(job_id, state=JOB_PLACING, pages_total=1)
+        result = processor.add_qr_to_buffer(data, job.qr_content, placements=placements)
+        success = result is not None
+        if success and not return_result:
+            with open(job.output_path, 'wb') as output_file:
+                output_file.write(result)
+            result = None
+    if success and placements != cached_placements:
+        cache.put(cache_key, placements)
+
+    if not success:
+        jobs.update_job(job_id, state=JOB_FAILED, error="Не удалось найти подходящее место для QR-кода")
+        return JOB_FAILED, None
+    if result is None:
+        jobs.update_job(job_id, state=JOB_READY)
+    return JOB_READY, result
+
+
+class QueueFullError(Exception):
+    """Очередь обработки переполнена"""
+
+
+class ProcessingPool:
+    """
+    Асинхронная обертка над пулом потоков или процессов.
+
+    Тяжелая обработка (pdftoppm, YOLO) выполняется вне цикла событий, поэтому
+    бот продолжает принимать обновления. Общее число задач ограничено размером
+    очереди, а число одновременных задач одного пользователя - per_user_limit.
+    """
+
+    def __init__(self, mode=WORKER_MODE, workers=WORKER_COUNT,
+                 queue_size=QUEUE_SIZE, per_user_limit=PER_USER_LIMIT):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Неизвестный режим пула: {mode}")
+        self.mode = mode
+        self.workers = workers
+        self.queue_size = queue_size
+        self.per_user_limit = per_user_limit
+        self._executor = None
+        self._pending = 0
+        self._user_semaphores = {}
+        self._user_tasks = {}
+
+    @property
+    def pending(self):
+        """Количество задач в очереди и в работе"""
+        return self._pending
+
+    def start(self):
+        """Создает пул исполнителей"""
+        if self._executor is not None:
+            return
+        if self.mode == 'process':
+            # fork небезопасен для процессов с загруженным torch
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        else:
+            global _concurrent_jobs
+            _concurrent_jobs = self.workers > 1
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix='qr_worker'
+            )
+        logger.info(f"Пул обработки запущен: режим={self.mode}, обработчиков={self.workers}, "
+                    f"очередь={self.queue_size}, лимит на пользователя={self.per_user_limit}")
+
+    async def submit(self, user_id, func, *args):
+        """
+        Выполняет func(*args) в пуле и возвращает результат
+
+        Raises:
+            QueueFullError: если очередь заполнена
+        """
+        if self._executor is None:
+            raise RuntimeError("Пул обработки не запущен")
+        if self._pending >= self.queue_size:
+            raise QueueFullError(f"В очереди уже {self._pending} задач")
+
+        semaphore = self._user_semaphores.get(user_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_user_limit)
+            self._user_semaphores[user_id] = semaphore
+
+        self._pending += 1
+        self._user_tasks[user_id] = self._user_tasks.get(user_id, 0) + 1
+        try:
+            async with semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+            self._user_tasks[user_id] -= 1
+            if not self._user_tasks[user_id]:
+                del self._user_tasks[user_id]
+                del self._user_semaphores[user_id]
+
+    def shutdown(self):
+        """Останавливает пул, дожидаясь задач в работе и отменяя ожидающие"""
+        if self._executor is None:
+            return
+        logger.info("Остановка пула обработки...")
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+        logger.info("Пул обработки остановлен")
+
+
+def worker_loop(worker_name, stop_event, poll_interval):
+    """
+    Цикл отдельного процесса-обработчика в режиме раздельного развертывания
+
+    Модель загружается один раз при старте, после чего процесс забирает
+    задачи из общей очереди в БД, пока не будет установлен stop_event.
+    """
+    logging.basicConfig(
+        format=f'%(asctime)s - {worker_name} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    # Остановкой управляет родительский процесс через stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    get_processor().get_detector()
+    logger.info(f"Обработчик {worker_name} готов к работе")
+
+    while not stop_event.is_set():
+        job_id = jobs.claim_next_job(worker_name)
+        if job_id is None:
+            stop_event.wait(poll_interval)
+            continue
+        logger.info(f"Обработчик {worker_name} взял задачу {job_id}")
+        try:
+            state, _ = run_job(job_id)
+            logger.info(f"Задача {job_id} завершена в состоянии {state}")
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении задачи {job_id}: {str(e)}", exc_info=True)
+            jobs.update_job(job_id, state=JOB_FAILED, error=str(e))
+
+    logger.info(f"Обработчик {worker_name} остановлен")
+
+
+def main():
+    """
+    Запуск процессов-обработчиков для раздельного развертывания (QR_DEPLOY_MODE=split)
+
+    Бот только принимает файлы и ставит задачи в очередь, а эти процессы
+    разбирают ее. Упавший процесс перезапускается, его задачи возвращаются в очередь.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Процессы обработки документов QR-бота')
+    parser.add_argument('--processes', type=int, default=WORKER_COUNT, help='Количество процессов')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='Интервал опроса очереди в секундах')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    # Задачи, прерванные прошлым запуском, возвращаются в очередь
+    session = jobs.get_session()
+    try:
+        jobs.requeue_jobs(session)
+    finally:
+        session.close()
+
+    context = multiprocessing.get_context('spawn')
+    stop_event = context.Event()
+    processes = {}
+
+    def start_process(name):
+        process = context.Process(target=worker_loop, args=(name, stop_event, args.poll_interval), name=name)
+        process.start()
+        processes[name] = process
+
+    def request_stop(signum, frame):
+        logger.info("Получен сигнал остановки, ожидаем завершения текущих задач...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    for i in range(args.processes):
+        start_process(f"worker-{i + 1}")
+
+    while not stop_event.is_set():
+        for name, process in list(processes.items()):
+            if not process.is_alive() and not stop_event.is_set():
+                logger.warning(f"Обработчик {name} завершился с кодом {process.exitcode}, перезапуск")
+                session = jobs.get_session()
+                try:
+                    jobs.requeue_jobs(session, claimed_by=name)
+                finally:
+                    session.close()
+                start_process(name)
+        time.sleep(1)
+
+    for process in processes.values():
+        process.join()
+    logger.info("Все обработчики остановлены")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@ import numpy as np
 from pathlib import Path
 import sys
 import os
+import hashlib
+import threading
+from .onnx_backend import OnnxModel, check_quantization_gate
 
 # Получаем путь к корню проекта
 PROJECT_ROOT = str(Path(__file__).parent.parent.absolute())
@@ -28,113 +31,246 @@ except ImportError as e:
     print(f"Содержимое директории models: {os.listdir(os.path.join(YOLOV5_PATH, 'models'))}")
     raise
 
+# Цвет полей letterbox, как при обучении YOLOv5
+LETTERBOX_COLOR = 114
+# Версия подготовки изображений для сети. Входит в ключи кэша позиций и компоновок:
+# при ее смене найденные раньше места пересчитываются
+PREPROCESS_VERSION = 'letterbox-1'
+
+
 class YOLODetector:
-    def __init__(self, weights_path='runs/train/exp4/weights/best.pt', device=''):
+    def __init__(self, weights_path='runs/train/exp4/weights/best.pt', device='', max_batch_size=8,
+                 intra_op_threads=0, inter_op_threads=0, check_gate=True):
         """
         Инициализация детектора YOLOv5
         
         Args:
-            weights_path (str): Путь к весам модели
+            weights_path (str): Путь к весам модели (.pt или .onnx, см. export_onnx.py)
             device (str): Устройство для инференса ('cpu' или 'cuda:0')
+            max_batch_size (int): Максимальное число изображений за один проход сети
+            intra_op_threads (int): Для .onnx: потоков внутри одного оператора (0 - по числу ядер)
+            inter_op_threads (int): Для .onnx: потоков для независимых операторов
+            check_gate (bool): Загружать квантованные веса, только если они прошли
+                проверку точности quantize_onnx.py (False - только для самой проверки)
         """
         # Преобразуем относительный путь в абсолютный
         if not os.path.isabs(weights_path):
             weights_path = os.path.join(PROJECT_ROOT, weights_path)
             
-        self.device = select_device(device)
-        self.model = DetectMultiBackend(weights_path, device=self.device)
+        self.weights_path = weights_path
+        self.weights_hash = self._file_hash(weights_path)
+        self.preprocess_version = PREPROCESS_VERSION
+        if weights_path.endswith('.onnx'):
+            # ONNX Runtime на CPU заметно быстрее PyTorch в режиме eager
+            self.device = select_device('cpu')
+            self.model = OnnxModel(weights_path, intra_op_threads, inter_op_threads)
+            if self.model.quantization and check_gate:
+                # Квантованные веса допускаются, только если прошли проверку точности
+                check_quantization_gate(weights_path, self.weights_hash)
+        else:
+            self.device = select_device(device)
+            self.model = DetectMultiBackend(weights_path, device=self.device)
         self.stride = self.model.stride
         self.names = self.model.names
         self.imgsz = check_img_size((640, 640), s=self.stride)
         
         # Размер QR-кода (в пикселях)
         self.qr_size = 150
+        self.max_batch_size = max(1, max_batch_size)
+
+        names = self.names.items() if isinstance(self.names, dict) else enumerate(self.names)
+        self.empty_space_class = next(int(index) for index, name in names if name == 'empty_space')
+
+        # Буферы входа сети выделяются один раз: холст для letterbox одного
+        # изображения и входной тензор на max_batch_size изображений.
+        # Доступ к ним (и к модели) - под блокировкой
+        height, width = self.imgsz
+        self._canvas = np.full((height, width, 3), LETTERBOX_COLOR, dtype=np.uint8)
+        self._canvas_tensor = torch.from_numpy(self._canvas)
+        self._input = torch.empty((self.max_batch_size, 3, height, width), dtype=torch.float32, device=self.device)
+        self._lock = threading.Lock()
         
-    def find_empty_space(self, image_path):
+    @staticmethod
+    def _file_hash(path):
+        """SHA-256 файла весов (используется в ключах кэша результатов)"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def find_empty_space(self, image_path, qr_size=None):
         """
         Находит пустое место на чертеже для размещения QR-кода
         
         Args:
-            image_path (str): Путь к изображению чертежа
+            image_path (str | np.ndarray): Путь к изображению чертежа
+                или уже загруженное изображение в формате BGR
+            qr_size (int): Размер QR-кода в пикселях этого изображения
+                (по умолчанию self.qr_size)
             
         Returns:
             tuple: (x, y) координаты левого верхнего угла для размещения QR-кода
                    или None, если подходящее место не найдено
         """
-        # Преобразуем относительный путь в абсолютный
-        if not os.path.isabs(image_path):
-            image_path = str(Path(__file__).parent.absolute() / image_path)
-            
-        # Загружаем изображение с помощью OpenCV
-        img0 = cv2.imread(image_path)
-        if img0 is None:
-            print(f"Не удалось загрузить изображение: {image_path}")
-            return None
-            
-        # Изменяем размер изображения для YOLO
-        img = cv2.resize(img0, self.imgsz)
-        
-        # Подготовка изображения
-        img = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
-        img = np.ascontiguousarray(img)
-        img = torch.from_numpy(img).to(self.device)
-        img = img.float()
-        img /= 255
-        if len(img.shape) == 3:
-            img = img[None]
-        
-        # Инференс
-        pred = self.model(img)
-        pred = non_max_suppression(pred, conf_thres=0.1, iou_thres=0.45)
-        
-        # Получаем размеры оригинального изображения
-        height, width = img0.shape[:2]
-        
-        print("\nНайденные объекты:")
-        
-        # Ищем пустые места (класс empty_space)
-        empty_spaces = []
-        for i, det in enumerate(pred):
-            if len(det):
-                # Масштабируем координаты к размеру оригинального изображения
-                det[:, :4] = scale_boxes(img.shape[2:], det[:, :4], img0.shape).round()
-                
-                for *xyxy, conf, cls in det:
-                    class_name = self.names[int(cls)]
-                    confidence = float(conf)
-                    print(f"- {class_name} (уверенность: {confidence:.2f})")
-                    
-                    if class_name == 'empty_space':
-                        x1, y1, x2, y2 = map(int, xyxy)
-                        width = x2 - x1
-                        height = y2 - y1
-                        area = width * height
-                        print(f"  Найдено пустое место: x1={x1}, y1={y1}, x2={x2}, y2={y2}, размер={width}x{height}")
-                        empty_spaces.append({
-                            'coords': (x1, y1),
-                            'area': area,
-                            'width': width,
-                            'height': height
-                        })
-        
-        if not empty_spaces:
+        if isinstance(image_path, np.ndarray):
+            img0 = image_path
+        else:
+            # Преобразуем относительный путь в абсолютный
+            if not os.path.isabs(image_path):
+                image_path = str(Path(__file__).parent.absolute() / image_path)
+
+            # Загружаем изображение с помощью OpenCV
+            img0 = cv2.imread(image_path)
+            if img0 is None:
+                print(f"Не удалось загрузить изображение: {image_path}")
+                return None
+
+        return self.find_empty_spaces([img0], qr_size)[0]
+
+    def _letterbox(self, img0):
+        """
+        Вписывает изображение BGR в холст входа сети с сохранением пропорций
+
+        Растягивание до 640x640 искажало бы листы формата A, а сеть обучена
+        на изображениях с полями (letterbox).
+
+        Returns:
+            tuple: (масштаб, (отступ слева, отступ сверху))
+        """
+        height, width = self.imgsz
+        h0, w0 = img0.shape[:2]
+        ratio = min(height / h0, width / w0)
+        new_w = min(width, max(1, round(w0 * ratio)))
+        new_h = min(height, max(1, round(h0 * ratio)))
+        left, top = (width - new_w) // 2, (height - new_h) // 2
+
+        self._canvas[:] = LETTERBOX_COLOR
+        interpolation = cv2.INTER_AREA if ratio < 1 else cv2.INTER_LINEAR
+        self._canvas[top:top + new_h, left:left + new_w] = cv2.resize(img0, (new_w, new_h),
+                                                                      interpolation=interpolation)
+        return ratio, (left, top)
+
+    def _fill_input(self, images):
+        """
+        Заполняет входной тензор изображениями пакета (RGB, 0..1)
+
+        Returns:
+            tuple: (тензор пакета - срез self._input, параметры letterbox для каждого изображения)
+        """
+        letterboxes = []
+        for i, img0 in enumerate(images):
+            letterboxes.append(self._letterbox(img0))
+            # BGR -> RGB и HWC -> CHW копированием каналов, без промежуточных массивов
+            for channel in range(3):
+                self._input[i, channel].copy_(self._canvas_tensor[:, :, 2 - channel])
+        batch = self._input[:len(images)]
+        batch.div_(255)
+        return batch, letterboxes
+
+    def prepare_input(self, images):
+        """
+        Входной тензор сети для пакета изображений BGR: массив NCHW float32 в диапазоне 0..1
+
+        Используется для калибровки квантованной модели (quantize_onnx.py);
+        возвращает копию, так как буфер входа переиспользуется.
+        """
+        with self._lock:
+            batch, _ = self._fill_input(images)
+            return batch.cpu().numpy().copy()
+
+    def find_empty_spaces(self, images, qr_size=None):
+        """
+        Находит пустые места сразу для нескольких изображений
+
+        Изображения подаются в сеть пакетами не больше max_batch_size, чтобы
+        не держать в памяти входной тензор для всех страниц документа сразу.
+
+        Args:
+            images (list[np.ndarray]): Изображения в формате BGR
+            qr_size (int | list): Размер QR-кода в пикселях (по умолчанию self.qr_size),
+                общий или свой для каждого изображения
+
+        Returns:
+            list: Для каждого изображения (x, y) или None
+        """
+        qr_sizes = qr_size if isinstance(qr_size, (list, tuple)) else [qr_size] * len(images)
+        results = []
+        for start in range(0, len(images), self.max_batch_size):
+            end = start + self.max_batch_size
+            results.extend(self._find_empty_spaces_batch(images[start:end], qr_sizes[start:end]))
+        return results
+
+    def _predict(self, images):
+        """
+        Один проход сети для пакета изображений
+
+        Returns:
+            list[torch.Tensor]: Для каждого изображения рамки класса empty_space
+                N x 5 (x1, y1, x2, y2, уверенность) в пикселях исходного изображения
+        """
+        with self._lock, torch.inference_mode():
+            img, letterboxes = self._fill_input(images)
+
+            # Инференс
+            pred = self.model(img)
+            pred = non_max_suppression(pred, conf_thres=0.1, iou_thres=0.45, classes=[self.empty_space_class])
+
+            boxes = []
+            for det, img0, (ratio, pad) in zip(pred, images, letterboxes):
+                # Обратное преобразование letterbox: минус поля, деление на масштаб
+                det[:, :4] = scale_boxes(img.shape[2:], det[:, :4], img0.shape, ratio_pad=((ratio, ratio), pad))
+                boxes.append(det[:, :5])
+            return boxes
+
+    def _find_empty_spaces_batch(self, images, qr_sizes):
+        """Места для QR-кода на пакете изображений за один проход сети"""
+        if not images:
+            return []
+
+        boxes = self._predict(images)
+        return [self._select_space(det, qr_size or self.qr_size) for det, qr_size in zip(boxes, qr_sizes)]
+
+    def find_boxes(self, images):
+        """
+        Пустые места (класс empty_space), найденные сетью, без выбора места для QR-кода
+
+        Используется для сравнения моделей (test_onnx_parity.py, quantize_onnx.py).
+
+        Args:
+            images (list[np.ndarray]): Изображения в формате BGR
+
+        Returns:
+            list[np.ndarray]: Для каждого изображения массив N x 5 (x1, y1, x2, y2, уверенность)
+                в пикселях исходного изображения
+        """
+        results = []
+        for start in range(0, len(images), self.max_batch_size):
+            results.extend(det.cpu().numpy() for det in self._predict(images[start:start + self.max_batch_size]))
+        return results
+
+    @staticmethod
+    def _select_space(det, qr_size):
+        """
+        Выбирает место для QR-кода среди пустых мест одного изображения
+
+        Берется самое большое по площади место; оно подходит, если QR-код в нем помещается.
+        """
+        if not len(det):
             print("Не найдено пустых мест на изображении.")
             return None
-        
-        # Выбираем самое большое пустое место
-        if empty_spaces:
-            best_space = max(empty_spaces, key=lambda x: x['area'])
-            x, y = best_space['coords']
-            
-            # Проверяем, достаточно ли места для QR-кода
-            if best_space['width'] >= self.qr_size and best_space['height'] >= self.qr_size:
-                print(f"\nВыбрано место размером {best_space['width']}x{best_space['height']} пикселей")
-                print(f"Координаты: x={x}, y={y}")
-                return (x, y)
-            else:
-                print(f"\nНайденное место слишком маленькое: {best_space['width']}x{best_space['height']} пикселей")
-                return None
-        
+
+        xyxy = det[:, :4].round().long()
+        sizes = xyxy[:, 2:] - xyxy[:, :2]
+        best = int(torch.argmax(sizes[:, 0] * sizes[:, 1]))
+        x, y = (int(value) for value in xyxy[best, :2])
+        width, height = (int(value) for value in sizes[best])
+
+        # Проверяем, достаточно ли места для QR-кода
+        if width >= qr_size and height >= qr_size:
+            print(f"Выбрано место размером {width}x{height} пикселей из {len(det)}, координаты: x={x}, y={y}")
+            return (x, y)
+        print(f"Найденное место слишком маленькое: {width}x{height} пикселей")
         return None
     
     def visualize_detection(self, image_path, output_path):
@@ -156,8 +292,8 @@ class YOLODetector:
         if image is None:
             return False
         
-        # Находим пустое место
-        position = self.find_empty_space(image_path)
+        # Находим пустое место (изображение уже загружено)
+        position = self.find_empty_space(image)
         if position is None:
             return False
         
@@ -0,0 +1,65 @@
+"""
+Сравнение задержки детектора на разных весах (PyTorch .pt, ONNX .onnx).
+
+Для каждого файла весов и размера пакета изображения прогоняются через
+find_empty_spaces несколько раз; выводится время на изображение (среднее
+и 95-й перцентиль). Первые проходы не учитываются (прогрев).
+
+Пример:
+    python benchmark_detector.py --weights runs/train/exp4/weights/best.pt runs/train/exp4/weights/best.onnx
+    QR_ONNX_INTRA_OP_THREADS=2 python benchmark_detector.py --weights ... --batch 1 4 8
+"""
+import time
+import argparse
+import statistics
+import numpy as np
+
+from app.yolo_detector import YOLODetector
+from app.model_registry import ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS
+from app.eval_utils import VAL_IMAGES, load_images
+
+
+def benchmark(detector, images, batch_size, repeats, warmup=2):
+    """
+    Returns:
+        list[float]: Время на изображение для каждого пакета, мс
+    """
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    for batch in batches[:warmup]:
+        detector.find_empty_spaces(batch)
+    timings = []
+    for _ in range(repeats):
+        for batch in batches:
+            started = time.perf_counter()
+            detector.find_empty_spaces(batch)
+            timings.append((time.perf_counter() - started) * 1000 / len(batch))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка детектора на разных весах')
+    parser.add_argument('--weights', nargs='+', required=True, help='Файлы весов (.pt, .onnx)')
+    parser.add_argument('--source', default=VAL_IMAGES, help='Каталог с изображениями или файл')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 8], help='Размеры пакета')
+    parser.add_argument('--repeats', type=int, default=3, help='Повторов на каждый размер пакета')
+    args = parser.parse_args()
+
+    images = [image for _, image in load_images(args.source)]
+    if not images:
+        print(f"Нет изображений в {args.source}")
+        return
+    print(f"Изображений: {len(images)}")
+
+    for weights in args.weights:
+        detector = YOLODetector(weights_path=weights, device='cpu', max_batch_size=max(args.batch),
+                                intra_op_threads=ONNX_INTRA_OP_THREADS, inter_op_threads=ONNX_INTER_OP_THREADS)
+        for batch_size in args.batch:
+            timings = benchmark(detector, images, batch_size, args.repeats)
+            print(
+                f"{weights}, пакет {batch_size}: {statistics.mean(timings):.1f} мс на изображение, "
+                f"p95 {np.percentile(timings, 95):.1f} мс"
+            )
+
+
+if __name__ == '__main__':
+    main()
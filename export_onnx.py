@@ -0,0 +1,73 @@
+"""
+Экспорт весов детектора в ONNX для инференса на CPU через ONNX Runtime.
+
+По умолчанию берутся самые свежие runs/train/*/weights/best.pt, файл best.onnx
+записывается рядом с ними. Экспорт выполняет yolov5/export.py с динамическим
+размером пакета, так что модель принимает пакеты детектора (QR_DETECT_MAX_BATCH).
+
+Пример:
+    python export_onnx.py
+    python export_onnx.py --weights runs/train/exp4/weights/best.pt
+
+Затем веса подключаются переменной окружения:
+    QR_YOLO_WEIGHTS=runs/train/exp4/weights/best.onnx
+"""
+import os
+import sys
+import glob
+import argparse
+import subprocess
+
+
+def find_latest_weights(pattern='runs/train/*/weights/best.pt'):
+    """Самые свежие веса обучения"""
+    candidates = glob.glob(pattern)
+    if not candidates:
+        return None
+    return max(candidates, key=os.path.getmtime)
+
+
+def export_onnx(weights, imgsz=640, opset=12, simplify=False):
+    """
+    Экспортирует веса .pt в ONNX
+
+    Returns:
+        str: Путь к файлу .onnx
+    """
+    cmd = [
+        sys.executable,
+        'yolov5/export.py',
+        '--weights', weights,
+        '--include', 'onnx',
+        '--imgsz', str(imgsz),
+        '--opset', str(opset),
+        '--device', 'cpu',
+        '--dynamic',  # размер пакета задается при инференсе
+    ]
+    if simplify:
+        cmd.append('--simplify')
+    subprocess.run(cmd, check=True)
+    return os.path.splitext(weights)[0] + '.onnx'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Экспорт весов детектора в ONNX')
+    parser.add_argument('--weights', help='Веса .pt (по умолчанию самые свежие runs/train/*/weights/best.pt)')
+    parser.add_argument('--imgsz', type=int, default=640, help='Размер входа сети')
+    parser.add_argument('--opset', type=int, default=12, help='Версия набора операторов ONNX')
+    parser.add_argument('--simplify', action='store_true', help='Упростить граф через onnx-simplifier')
+    args = parser.parse_args()
+
+    weights = args.weights or find_latest_weights()
+    if weights is None or not os.path.isfile(weights):
+        print("Не найдены веса для экспорта")
+        sys.exit(1)
+
+    print(f"Экспорт {weights} в ONNX...")
+    onnx_path = export_onnx(weights, args.imgsz, args.opset, args.simplify)
+    print(f"Готово: {onnx_path}")
+    print(f"Проверка совпадения результатов: python test_onnx_parity.py --weights {weights}")
+
+
+if __name__ == '__main__':
+    main()
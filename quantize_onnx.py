@@ -0,0 +1,253 @@
+"""
+Статическое квантование модели ONNX в INT8 с проверкой точности.
+
+Модель калибруется на изображениях dataset_yolo/val, после чего квантованная
+и исходная (FP32) модели сравниваются на том же наборе:
+  - mAP@0.5 класса empty_space по разметке dataset_yolo/val/labels;
+  - доля изображений, на которых выбранное место для QR-кода совпадает
+    (с точностью до --max-shift пикселей или оба не нашли места).
+
+Отчет пишется в <веса>.int8.onnx.gate.json. YOLODetector загружает
+квантованные веса, только если отчет есть и проверка пройдена.
+
+Пример:
+    python export_onnx.py --weights runs/train/exp4/weights/best.pt
+    python quantize_onnx.py --onnx runs/train/exp4/weights/best.onnx
+    QR_YOLO_WEIGHTS=runs/train/exp4/weights/best.int8.onnx
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+from app.yolo_detector import YOLODetector
+from app.onnx_backend import GATE_REPORT_SUFFIX
+from app.eval_utils import box_iou, load_images
+
+DATASET = 'dataset_yolo/val'
+
+
+class ImageCalibrationReader:
+    """Подает калибровочные изображения в quantize_static по одному"""
+
+    def __init__(self, detector, images, input_name):
+        self.detector = detector
+        self.input_name = input_name
+        self._images = iter(images)
+
+    def get_next(self):
+        image = next(self._images, None)
+        if image is None:
+            return None
+        return {self.input_name: self.detector.prepare_input([image])}
+
+    def rewind(self):
+        pass
+
+
+def head_nodes(model):
+    """
+    Узлы после последних сверток (декодирование координат в слое Detect)
+
+    Квантование этих операций портит координаты рамок, поэтому они остаются в FP32.
+    """
+    consumers = {}
+    for node in model.graph.node:
+        for name in node.input:
+            consumers.setdefault(name, []).append(node)
+
+    def downstream(node):
+        seen, stack = {}, list(node.output)
+        while stack:
+            for consumer in consumers.get(stack.pop(), []):
+                if consumer.name not in seen:
+                    seen[consumer.name] = consumer
+                    stack.extend(consumer.output)
+        return seen.values()
+
+    excluded = set()
+    for node in model.graph.node:
+        if node.op_type != 'Conv':
+            continue
+        after = downstream(node)
+        if not any(n.op_type == 'Conv' for n in after):
+            excluded.update(n.name for n in after)
+    return sorted(excluded)
+
+
+def quantize(onnx_path, output_path, images, calibration_method='minmax'):
+    """Квантует веса и активации в INT8 с калибровкой на images"""
+    import onnx
+    from onnxruntime.quantization import (quantize_static, CalibrationMethod, QuantFormat, QuantType)
+
+    model = onnx.load(onnx_path)
+    detector = YOLODetector(weights_path=onnx_path)
+    reader = ImageCalibrationReader(detector, images, model.graph.input[0].name)
+    methods = {
+        'minmax': CalibrationMethod.MinMax,
+        'entropy': CalibrationMethod.Entropy,
+        'percentile': CalibrationMethod.Percentile,
+    }
+    quantize_static(
+        onnx_path, output_path, reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        nodes_to_exclude=head_nodes(model),
+        calibrate_method=methods[calibration_method],
+    )
+
+    # Имена классов и stride нужны OnnxModel; отметка 'quantization' требует проверки точности
+    quantized = onnx.load(output_path)
+    metadata = {prop.key: prop.value for prop in model.metadata_props}
+    metadata['quantization'] = 'int8'
+    del quantized.metadata_props[:]
+    for key, value in metadata.items():
+        quantized.metadata_props.add(key=key, value=value)
+    onnx.save(quantized, output_path)
+
+
+def load_labels(label_path, image_shape, class_index):
+    """Рамки класса class_index из разметки YOLO (x1, y1, x2, y2 в пикселях)"""
+    height, width = image_shape[:2]
+    boxes = []
+    if os.path.isfile(label_path):
+        with open(label_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 5 or int(parts[0]) != class_index:
+                    continue
+                cx, cy, w, h = (float(value) for value in parts[1:])
+                boxes.append(((cx - w / 2) * width, (cy - h / 2) * height,
+                              (cx + w / 2) * width, (cy + h / 2) * height))
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+
+def average_precision(detections, ground_truth, iou_threshold=0.5):
+    """
+    AP одного класса (площадь под кривой точность-полнота, как в YOLOv5)
+
+    Args:
+        detections (list[np.ndarray]): Для каждого изображения N x 5 (x1, y1, x2, y2, уверенность)
+        ground_truth (list[np.ndarray]): Для каждого изображения M x 4
+    """
+    total = sum(len(gt) for gt in ground_truth)
+    records = []
+    for det, gt in zip(detections, ground_truth):
+        matched = np.zeros(len(gt), dtype=bool)
+        for box in det[np.argsort(-det[:, 4])]:
+            ious = box_iou(box, gt)
+            best = int(np.argmax(ious)) if len(ious) else None
+            hit = best is not None and ious[best] >= iou_threshold and not matched[best]
+            if hit:
+                matched[best] = True
+            records.append((float(box[4]), hit))
+    if not total or not records:
+        return 0.0
+
+    records.sort(key=lambda record: -record[0])
+    hits = np.array([hit for _, hit in records])
+    tp = np.cumsum(hits)
+    fp = np.cumsum(~hits)
+    recall = np.concatenate(([0.0], tp / total, [1.0]))
+    precision = np.concatenate(([1.0], tp / np.maximum(tp + fp, 1e-9), [0.0]))
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    changes = np.where(recall[1:] != recall[:-1])[0]
+    return float(np.sum((recall[changes + 1] - recall[changes]) * precision[changes + 1]))
+
+
+def evaluate(detector, images, ground_truth):
+    """
+    Returns:
+        tuple: (mAP@0.5 класса empty_space, места для QR-кода по изображениям)
+    """
+    boxes = detector.find_boxes(images)
+    positions = detector.find_empty_spaces(images)
+    return average_precision(boxes, ground_truth), positions
+
+
+def placement_agreement(reference, candidate, max_shift):
+    """Доля изображений с совпадающим местом QR-кода"""
+    agreed = 0
+    for ref_pos, cand_pos in zip(reference, candidate):
+        if ref_pos is None or cand_pos is None:
+            agreed += ref_pos is None and cand_pos is None
+        else:
+            agreed += max(abs(ref_pos[0] - cand_pos[0]), abs(ref_pos[1] - cand_pos[1])) <= max_shift
+    return agreed / max(1, len(reference))
+
+
+def run_gate(onnx_path, int8_path, dataset, max_map_drop, min_agreement, max_shift):
+    """Сравнивает квантованную модель с исходной и пишет отчет рядом с int8_path"""
+    fp32 = YOLODetector(weights_path=onnx_path)
+    # Отчета еще нет (или он устарел), поэтому модель загружается без проверки
+    int8 = YOLODetector(weights_path=int8_path, check_gate=False)
+
+    samples = load_images(os.path.join(dataset, 'images'))
+    names = fp32.names.items() if isinstance(fp32.names, dict) else enumerate(fp32.names)
+    class_index = next(int(index) for index, name in names if name == 'empty_space')
+    images = [image for _, image in samples]
+    ground_truth = [
+        load_labels(os.path.join(dataset, 'labels', os.path.splitext(os.path.basename(path))[0] + '.txt'),
+                    image.shape, class_index)
+        for path, image in samples
+    ]
+
+    fp32_map, fp32_positions = evaluate(fp32, images, ground_truth)
+    int8_map, int8_positions = evaluate(int8, images, ground_truth)
+    agreement = placement_agreement(fp32_positions, int8_positions, max_shift)
+    passed = int8_map >= fp32_map - max_map_drop and agreement >= min_agreement
+
+    report = {
+        'weights_hash': int8.weights_hash,
+        'reference': os.path.abspath(onnx_path),
+        'dataset': os.path.abspath(dataset),
+        'images': len(images),
+        'fp32': {'map50': fp32_map},
+        'int8': {'map50': int8_map},
+        'placement_agreement': agreement,
+        'thresholds': {'max_map_drop': max_map_drop, 'min_agreement': min_agreement, 'max_shift': max_shift},
+        'passed': passed,
+    }
+    with open(int8_path + GATE_REPORT_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"Изображений: {len(images)}")
+    print(f"mAP@0.5 empty_space: FP32 {fp32_map:.3f}, INT8 {int8_map:.3f} (допустимое падение {max_map_drop:.3f})")
+    print(f"Совпадение мест QR-кода: {agreement:.1%} (нужно не меньше {min_agreement:.0%})")
+    print("Проверка пройдена, веса можно подключать" if passed else "Проверка не пройдена, веса не будут загружены")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Квантование модели ONNX в INT8 с проверкой точности')
+    parser.add_argument('--onnx', required=True, help='Исходная модель FP32 (.onnx, см. export_onnx.py)')
+    parser.add_argument('--output', help='Квантованная модель (по умолчанию <имя>.int8.onnx)')
+    parser.add_argument('--dataset', default=DATASET, help='Каталог с images/ и labels/ для калибровки и проверки')
+    parser.add_argument('--calibration-images', type=int, default=200, help='Изображений для калибровки')
+    parser.add_argument('--calibration-method', default='minmax', choices=['minmax', 'entropy', 'percentile'])
+    parser.add_argument('--max-map-drop', type=float, default=0.02, help='Допустимое падение mAP@0.5')
+    parser.add_argument('--min-agreement', type=float, default=0.95, help='Минимальная доля совпадающих мест')
+    parser.add_argument('--max-shift', type=int, default=8, help='Допустимый сдвиг места QR-кода, пикселей')
+    parser.add_argument('--evaluate-only', action='store_true', help='Только проверить уже квантованную модель')
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.onnx)[0] + '.int8.onnx'
+    if not args.evaluate_only:
+        images = [image for _, image in load_images(os.path.join(args.dataset, 'images'))]
+        if not images:
+            print(f"Нет изображений в {args.dataset}/images")
+            sys.exit(1)
+        images = images[:args.calibration_images]
+        print(f"Калибровка на {len(images)} изображениях...")
+        quantize(args.onnx, output, images, args.calibration_method)
+        print(f"Квантованная модель: {output}")
+
+    passed = run_gate(args.onnx, output, args.dataset, args.max_map_drop, args.min_agreement, args.max_shift)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Дымовые тесты доставки результата, ошибок и восстановления задач (app/bot.py) без Telegram.
+
+Бот импортируется во временном каталоге (там создаются documents.db и bot.log),
+вместо Telegram используется заглушка, которая запоминает отправленное.
+
+Пример:
+    python test_bot_delivery.py
+"""
+import os
+import sys
+import types
+import asyncio
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class StubBot:
+    """Заглушка telegram.Bot: запоминает отправленные документы и сообщения"""
+
+    def __init__(self):
+        self.documents = []
+        self.messages = []
+
+    async def send_document(self, chat_id, document, filename=None, caption=None):
+        self.documents.append((chat_id, filename, document.read()))
+
+    async def send_message(self, chat_id, text):
+        self.messages.append((chat_id, text))
+
+
+def import_bot(work_dir):
+    """Импортирует app.bot в режиме split (без пула обработки) с БД в work_dir"""
+    os.chdir(work_dir)
+    os.environ['QR_DEPLOY_MODE'] = 'split'
+    if PROJECT_ROOT not in sys.path:
+        sys.path.insert(0, PROJECT_ROOT)
+    try:
+        import app.config  # noqa: F401
+    except ImportError:
+        # Настройки с токеном не хранятся в репозитории
+        config = types.ModuleType('app.config')
+        config.BOT_TOKEN = 'test-token'
+        config.SAVE_DIRECTORY = os.path.join(work_dir, 'files')
+        sys.modules['app.config'] = config
+    from app import bot
+    return bot
+
+
+def create_job(bot, work_dir, state, output=None):
+    from app.models import Document
+    from app import jobs
+
+    session = bot.Session()
+    try:
+        document = Document(name='drawing.jpg', version='1', author='1')
+        session.add(document)
+        session.commit()
+        output_path = os.path.join(work_dir, f"out_{document.id}.jpg")
+        if output is not None:
+            with open(output_path, 'wb') as f:
+                f.write(output)
+        job = jobs.create_job(session, document, 42, 'drawing.jpg', output_path, output_path,
+                              os.path.join(work_dir, f"job_{document.id}"), 'qr', state=state)
+        return job.id
+    finally:
+        session.close()
+
+
+def load(bot, job_id):
+    from app.models import ProcessingJob, QRCode
+
+    session = bot.Session()
+    try:
+        job = session.get(ProcessingJob, job_id)
+        qr_codes = session.query(QRCode).filter(QRCode.document_id == job.document_id).count()
+        return job.state, job.notified, qr_codes
+    finally:
+        session.close()
+
+
+def test_deliver_job():
+    from app.models import JOB_READY, JOB_PLACING, JOB_SENT
+
+    work_dir = tempfile.mkdtemp(prefix='qr_bot_test_')
+    bot = import_bot(work_dir)
+    stub = StubBot()
+
+    # Результат записан обработчиком в output_path (режим split)
+    ready_job = create_job(bot, work_dir, JOB_READY, output=b'ready image')
+    asyncio.run(bot.deliver_job(stub, ready_job))
+    assert stub.documents == [(42, 'qr_drawing.jpg', b'ready image')]
+    assert load(bot, ready_job) == (JOB_SENT, True, 1)
+
+    # Результат передан из пула в памяти (режим local)
+    memory_job = create_job(bot, work_dir, JOB_PLACING)
+    asyncio.run(bot.deliver_job(stub, memory_job, b'memory image'))
+    assert stub.documents[-1] == (42, 'qr_drawing.jpg', b'memory image')
+    assert load(bot, memory_job) == (JOB_SENT, True, 1)
+
+    # Повторная доставка уже отправленной задачи ничего не отправляет
+    asyncio.run(bot.deliver_job(stub, ready_job))
+    assert len(stub.documents) == 2
+    assert not stub.messages
+    print("Тест успешно завершен: результат доставлен и задача закрыта")
+
+
+class FailingPool:
+    """Заглушка пула обработки, который не может выполнить задачу"""
+
+    mode = 'thread'
+
+    async def submit(self, user_id, func, *args):
+        raise RuntimeError("Не удалось загрузить модель")
+
+
+def test_execute_job_failure():
+    from app.models import JOB_QUEUED, JOB_FAILED
+
+    work_dir = tempfile.mkdtemp(prefix='qr_bot_test_')
+    bot = import_bot(work_dir)
+    stub = StubBot()
+
+    job_id = create_job(bot, work_dir, JOB_QUEUED)
+    bot.admission_controller.mark_admitted(job_id, 500)
+    bot.processing_pool = FailingPool()
+    asyncio.run(bot.execute_job(stub, job_id, '1'))
+
+    # Страницы задачи освобождены, задача закрыта, пользователь знает об ошибке
+    assert bot.admission_controller.pages_in_flight == 0
+    assert load(bot, job_id) == (JOB_FAILED, True, 0)
+    assert [chat_id for chat_id, _ in stub.messages] == [42]
+    assert not stub.documents
+    print("Тест успешно завершен: ошибка пула освобождает ресурсы задачи")
+
+
+def test_recover_own_jobs():
+    from app.models import ProcessingJob, JOB_QUEUED, JOB_PLACING
+    from app import jobs
+
+    work_dir = tempfile.mkdtemp(prefix='qr_bot_test_')
+    bot = import_bot(work_dir)
+
+    own_job = create_job(bot, work_dir, JOB_PLACING)
+    other_job = create_job(bot, work_dir, JOB_PLACING)
+    legacy_job = create_job(bot, work_dir, JOB_QUEUED)
+    session = bot.Session()
+    try:
+        session.get(ProcessingJob, own_job).claimed_by = 'replica-a'
+        session.get(ProcessingJob, other_job).claimed_by = 'replica-b'
+        session.commit()
+
+        # Экземпляр восстанавливает свои задачи и забирает задачу без владельца
+        recovered = [(job.id, job.state, job.claimed_by) for job in jobs.recover_jobs(session, 'replica-a')]
+        assert recovered == [(own_job, JOB_QUEUED, 'replica-a'), (legacy_job, JOB_QUEUED, 'replica-a')]
+        # Задача другого экземпляра осталась в работе у него
+        other = session.get(ProcessingJob, other_job)
+        assert (other.state, other.claimed_by) == (JOB_PLACING, 'replica-b')
+        assert [job.id for job in jobs.recover_jobs(session, 'replica-b')] == [other_job]
+    finally:
+        session.close()
+    print("Тест успешно завершен: экземпляр восстанавливает только свои задачи")
+
+
+class FailingBot(StubBot):
+    """Заглушка telegram.Bot, у которой не удается отправить документ"""
+
+    async def send_document(self, chat_id, document, filename=None, caption=None):
+        raise RuntimeError("Нет связи с Telegram")
+
+
+def test_deliver_once():
+    from app.models import JOB_READY, JOB_FAILED, JOB_SENT
+
+    work_dir = tempfile.mkdtemp(prefix='qr_bot_test_')
+    bot = import_bot(work_dir)
+    stub = StubBot()
+
+    # Несколько экземпляров бота видят один и тот же готовый результат
+    ready_job = create_job(bot, work_dir, JOB_READY, output=b'ready image')
+    failed_job = create_job(bot, work_dir, JOB_FAILED)
+
+    async def deliver_twice():
+        await asyncio.gather(*(bot.deliver_job(stub, job_id) for job_id in (ready_job, ready_job,
+                                                                            failed_job, failed_job)))
+
+    asyncio.run(deliver_twice())
+    assert len(stub.documents) == 1
+    assert len(stub.messages) == 1
+    assert load(bot, ready_job) == (JOB_SENT, True, 1)
+    assert load(bot, failed_job) == (JOB_FAILED, True, 0)
+
+    # Неудачная отправка возвращает результат к доставке
+    retry_job = create_job(bot, work_dir, JOB_READY, output=b'retry image')
+    try:
+        asyncio.run(bot.deliver_job(FailingBot(), retry_job))
+        assert False, "ошибка отправки должна передаваться вызывающему"
+    except RuntimeError:
+        pass
+    assert load(bot, retry_job)[0] == JOB_READY
+    asyncio.run(bot.deliver_job(stub, retry_job))
+    assert stub.documents[-1] == (42, 'qr_drawing.jpg', b'retry image')
+    print("Тест успешно завершен: каждый результат доставлен один раз")
+
+
+def test_recover_bot_jobs():
+    from app.models import ProcessingJob, JOB_DEFERRED, JOB_PLACING, JOB_READY, JOB_DELIVERING
+    from app import jobs
+
+    work_dir = tempfile.mkdtemp(prefix='qr_bot_test_')
+    bot = import_bot(work_dir)
+
+    own_job = create_job(bot, work_dir, JOB_DEFERRED)
+    other_job = create_job(bot, work_dir, JOB_DEFERRED)
+    worker_job = create_job(bot, work_dir, JOB_PLACING)
+    delivering_job = create_job(bot, work_dir, JOB_DELIVERING)
+    session = bot.Session()
+    try:
+        for job_id, owner in ((own_job, 'replica-a'), (other_job, 'replica-b'), (worker_job, 'worker-1'),
+                              (delivering_job, 'replica-a')):
+            session.get(ProcessingJob, job_id).claimed_by = owner
+        session.commit()
+
+        # Режим split: экземпляр восстанавливает допуск только своих задач,
+        # а прерванная им доставка снова ждет отправки
+        recovered = [job.id for job in jobs.recover_bot_jobs(session, 'replica-a')]
+        assert own_job in recovered and other_job not in recovered and worker_job not in recovered
+        assert session.get(ProcessingJob, delivering_job).state == JOB_READY
+        assert session.get(ProcessingJob, worker_job).state == JOB_PLACING
+    finally:
+        session.close()
+    print("Тест успешно завершен: экземпляр в режиме split восстанавливает только свои задачи")
+
+
+if __name__ == '__main__':
+    test_deliver_job()
+    test_execute_job_failure()
+    test_recover_own_jobs()
+    test_deliver_once()
+    test_recover_bot_jobs()
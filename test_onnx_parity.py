@@ -0,0 +1,81 @@
+"""
+Проверка, что модель ONNX находит те же пустые места, что и исходные веса PyTorch.
+
+Для каждого изображения каждое пустое место (empty_space) исходной модели
+с уверенностью не ниже --min-conf должно найтись у ONNX с IoU не ниже --min-iou
+и близкой уверенностью, а выбранное место для QR-кода - совпасть с точностью
+до --max-shift пикселей.
+
+Пример:
+    python test_onnx_parity.py --weights runs/train/exp4/weights/best.pt
+"""
+import os
+import sys
+import argparse
+import numpy as np
+
+from app.yolo_detector import YOLODetector
+from app.eval_utils import VAL_IMAGES, box_iou, load_images
+
+WEIGHTS = 'runs/train/exp4/weights/best.pt'
+SOURCE = VAL_IMAGES
+
+
+def compare_models(weights, onnx_weights, source, min_conf=0.25, min_iou=0.9, max_conf_diff=0.05, max_shift=4):
+    reference = YOLODetector(weights_path=weights, device='cpu')
+    candidate = YOLODetector(weights_path=onnx_weights)
+
+    images = load_images(source)
+    if not images:
+        print(f"Нет изображений в {source}")
+        return False
+    print(f"Изображений: {len(images)}")
+
+    arrays = [image for _, image in images]
+    reference_boxes = reference.find_boxes(arrays)
+    candidate_boxes = candidate.find_boxes(arrays)
+    reference_positions = reference.find_empty_spaces(arrays)
+    candidate_positions = candidate.find_empty_spaces(arrays)
+
+    failures = 0
+    for (path, _), ref, cand, ref_pos, cand_pos in zip(images, reference_boxes, candidate_boxes,
+                                                      reference_positions, candidate_positions):
+        for box in ref[ref[:, 4] >= min_conf]:
+            ious = box_iou(box, cand)
+            best = int(np.argmax(ious)) if len(ious) else None
+            if best is None or ious[best] < min_iou:
+                print(f"{path}: место {box[:4].round().tolist()} не найдено моделью ONNX")
+                failures += 1
+            elif abs(cand[best, 4] - box[4]) > max_conf_diff:
+                print(f"{path}: уверенность {box[4]:.3f} против {cand[best, 4]:.3f}")
+                failures += 1
+        if (ref_pos is None) != (cand_pos is None) or (
+                ref_pos is not None and max(abs(ref_pos[0] - cand_pos[0]), abs(ref_pos[1] - cand_pos[1])) > max_shift):
+            print(f"{path}: место QR-кода {ref_pos} против {cand_pos}")
+            failures += 1
+
+    if failures:
+        print(f"Тест не пройден: расхождений {failures}")
+        return False
+    print("Тест успешно завершен: результаты ONNX совпадают с PyTorch")
+    return True
+
+
+def test_onnx_parity():
+    assert compare_models(WEIGHTS, os.path.splitext(WEIGHTS)[0] + '.onnx', SOURCE)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сравнение модели ONNX с исходными весами')
+    parser.add_argument('--weights', default=WEIGHTS, help='Исходные веса .pt')
+    parser.add_argument('--onnx', help='Веса .onnx (по умолчанию рядом с --weights)')
+    parser.add_argument('--source', default=SOURCE, help='Каталог с изображениями или файл')
+    parser.add_argument('--min-conf', type=float, default=0.25, help='Сравниваются места с уверенностью не ниже')
+    parser.add_argument('--min-iou', type=float, default=0.9, help='Минимальное IoU совпадающих мест')
+    parser.add_argument('--max-shift', type=int, default=4, help='Допустимый сдвиг места QR-кода, пикселей')
+    args = parser.parse_args()
+
+    onnx_weights = args.onnx or os.path.splitext(args.weights)[0] + '.onnx'
+    ok = compare_models(args.weights, onnx_weights, args.source, args.min_conf, args.min_iou,
+                        max_shift=args.max_shift)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,217 @@
+"""
+Локальный стенд для режима webhook.
+
+Поднимает поддельный Telegram Bot API, запускает бота в режиме webhook
+(app/bot.py с QR_BOT_MODE=webhook) и отправляет ему синтетические обновления.
+Для каждого обновления измеряется время от отправки до ответа бота
+(вызова sendMessage), настоящий API Telegram при этом не нужен.
+
+Пример:
+    python webhook_harness.py --updates 200 --concurrency 20
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import statistics
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'QR bot', 'username': 'qr_test_bot'}
+
+
+class FakeTelegramApi:
+    """Минимальная замена Bot API: отвечает на запросы бота и запоминает время ответов"""
+
+    def __init__(self, port):
+        self.port = port
+        self.replies = {}  # текст обновления -> время ответа бота
+        self.replies_lock = threading.Lock()
+        self.reply_event = threading.Condition(self.replies_lock)
+        self.message_ids = itertools.count(1)
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                params = {}
+                if body and self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body)
+                elif body:
+                    params = dict(httpx.QueryParams(body.decode()))
+                self._reply(api.handle(method, params))
+
+            do_GET = do_POST
+
+            def _reply(self, result):
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('setWebhook', 'deleteWebhook'):
+            return True
+        if method == 'sendMessage':
+            text = params.get('text', '')
+            # Бот отвечает "Вы написали: '<текст>'..." - по тексту находим обновление
+            key = text.split("'")[1] if text.count("'") >= 2 else text
+            with self.reply_event:
+                self.replies[key] = time.perf_counter()
+                self.reply_event.notify_all()
+            return {
+                'message_id': next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'from': BOT_USER,
+                'text': text,
+            }
+        return True
+
+    def wait_reply(self, key, timeout):
+        deadline = time.monotonic() + timeout
+        with self.reply_event:
+            while key not in self.replies:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.reply_event.wait(remaining)
+            return self.replies[key]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def make_update(update_id, text):
+    """Синтетическое текстовое обновление от пользователя"""
+    user = {'id': 1000 + update_id % 50, 'is_bot': False, 'first_name': 'Тест'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user['id'], 'type': 'private'},
+            'from': user,
+            'text': text,
+        },
+    }
+
+
+async def send_updates(api, webhook_url, secret, count, concurrency, timeout):
+    """Отправляет обновления и возвращает список задержек в секундах"""
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    latencies = []
+    failures = 0
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        async def one(update_id):
+            nonlocal failures
+            text = f"ping-{update_id}"
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(webhook_url, json=make_update(update_id, text), headers=headers)
+                if response.status_code != 200:
+                    failures += 1
+                    return
+                replied = await asyncio.to_thread(api.wait_reply, text, timeout)
+                if replied is None:
+                    failures += 1
+                    return
+                latencies.append(replied - started)
+
+        await asyncio.gather(*(one(i) for i in range(1, count + 1)))
+    return latencies, failures
+
+
+def wait_for_port(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return True
+        except httpx.TransportError:
+            time.sleep(0.5)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный стенд для режима webhook')
+    parser.add_argument('--updates', type=int, default=100, help='Количество обновлений')
+    parser.add_argument('--concurrency', type=int, default=10, help='Одновременных запросов')
+    parser.add_argument('--api-port', type=int, default=8081, help='Порт поддельного Bot API')
+    parser.add_argument('--webhook-port', type=int, default=8443, help='Порт webhook бота')
+    parser.add_argument('--secret', default='harness-secret', help='Секретный токен webhook')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Ожидание ответа, с')
+    parser.add_argument('--no-start-bot', action='store_true',
+                        help='Не запускать бота (он уже запущен с нужными переменными окружения)')
+    args = parser.parse_args()
+
+    api = FakeTelegramApi(args.api_port)
+    api.start()
+    webhook_url = f"http://127.0.0.1:{args.webhook_port}/telegram"
+
+    bot_process = None
+    if not args.no_start_bot:
+        env = dict(
+            os.environ,
+            QR_BOT_MODE='webhook',
+            QR_WEBHOOK_URL=webhook_url,
+            QR_WEBHOOK_LISTEN='127.0.0.1',
+            QR_WEBHOOK_PORT=str(args.webhook_port),
+            QR_WEBHOOK_PATH='telegram',
+            QR_WEBHOOK_SECRET=args.secret,
+            QR_TELEGRAM_API_URL=f"http://127.0.0.1:{args.api_port}/bot",
+        )
+        bot_process = subprocess.Popen([sys.executable, os.path.join('app', 'bot.py')], env=env)
+
+    try:
+        if not wait_for_port(webhook_url, 60):
+            print("Бот не запустился")
+            return
+        print(f"Отправка {args.updates} обновлений, одновременно {args.concurrency}...")
+        started = time.perf_counter()
+        latencies, failures = asyncio.run(send_updates(
+            api, webhook_url, args.secret, args.updates, args.concurrency, args.timeout
+        ))
+        elapsed = time.perf_counter() - started
+
+        print(f"\nУспешно: {len(latencies)}, ошибок: {failures}, время: {elapsed:.2f} с "
+              f"({len(latencies) / elapsed:.1f} обновлений/с)")
+        if latencies:
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"Задержка обновление -> ответ: медиана {statistics.median(latencies) * 1000:.1f} мс, "
+                  f"p95 {p95 * 1000:.1f} мс, максимум {latencies[-1] * 1000:.1f} мс")
+    finally:
+        if bot_process is not None:
+            bot_process.terminate()
+            bot_process.wait()
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()